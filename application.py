@@ -10,18 +10,26 @@ references:
 """
 
 # used imports
+import atexit
 import os
-import requests
+import hashlib
+import hmac
 import json
+import math
 import re
+import threading
+import time
 
+from concurrent import futures
 from flask import Flask, session, render_template, request, abort, redirect, \
-                  jsonify, escape
-from flask_session import Session
-from sqlalchemy import create_engine
+                  escape, Response, stream_with_context, g, url_for, Markup
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import text, bindparam
 from sqlalchemy.orm import scoped_session, sessionmaker
-from werkzeug.exceptions import default_exceptions, HTTPException
-from functions import security
+from werkzeug.exceptions import default_exceptions, HTTPException, \
+    TooManyRequests
+from functions import security, search_index, goodreads, sessions, cache, \
+    export, dbpool, metrics, suggest, catalog, ratelimit, reviews
 
 # create flask app
 app = Flask(__name__)
@@ -33,24 +41,355 @@ app.config['JSON_SORT_KEYS'] = False
 if not os.getenv("DATABASE_URL"):
     raise RuntimeError("DATABASE_URL is not set")
 
-# Configure session to use filesystem
+# Configure session (SESSION_BACKEND: filesystem, cookie, memory or redis)
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+app.config["PERMANENT_SESSION_LIFETIME"] = int(os.getenv("SESSION_LIFETIME",
+                                                         24 * 3600))
+sessions.init_app(app, os.getenv("SESSION_BACKEND", "filesystem"))
 # app.run(threaded=True)
 
-# Set up database
-engine = create_engine(os.getenv("DATABASE_URL"))
+# Set up database (the pool is configured with the DB_POOL_* variables)
+engine = dbpool.create_pooled_engine(os.getenv("DATABASE_URL"))
 db = scoped_session(sessionmaker(bind=engine))
 
-# create a secret_key
-app.secret_key = os.urandom(16)
+# measure the database queries (see /metrics)
+dbpool.instrument(engine)
+
+# add the Server-Timing header to the responses if SERVER_TIMING=1
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+
+@app.before_request
+def start_timing():
+    """
+    starts the timing of the request
+    """
+
+    metrics.start_request()
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def end_timing(response):
+    """
+    records the latency, database queries and time of the request and adds
+        the Server-Timing header if SERVER_TIMING is set
+
+    parameters:
+        response - is the response of the request
+
+    returns the response
+    """
+
+    timings = metrics.end_request()
+    if timings is None or "request_start" not in g:
+        return response
+
+    # record the request per endpoint
+    seconds = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or "none"
+    metrics.observe("request_seconds", seconds, endpoint=endpoint)
+    metrics.observe("db_queries_per_request", timings["db_count"],
+                    metrics.COUNT_BUCKETS, endpoint=endpoint)
+    metrics.observe("db_seconds_per_request", timings["db"],
+                    endpoint=endpoint)
+
+    # tell the client where the time went (in milliseconds)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = \
+            f'app;dur={seconds * 1000:.2f}, ' \
+            f'db;dur={timings["db"] * 1000:.2f};' \
+            f'desc="{timings["db_count"]} queries", ' \
+            f'goodreads;dur={timings["ext"] * 1000:.2f}, ' \
+            f'pbkdf2;dur={timings["kdf"] * 1000:.2f}'
+
+    return response
+
+
+@app.teardown_appcontext
+def remove_db_session(error=None):
+    """
+    ends the database session of the request so its connection goes back
+        to the pool and no transaction is left open
+    """
+
+    db.remove()
+
+
+# create a secret_key (set SECRET_KEY for cookie sessions with more workers)
+app.secret_key = os.getenv("SECRET_KEY") or os.urandom(16)
+
+# use the in-memory search index unless the database search is requested
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "index")
+
+# seconds between checks for new, changed or deleted books in the books table
+SEARCH_REFRESH = float(os.getenv("SEARCH_REFRESH", 60))
+
+# number of reviews on a page of the book page
+REVIEWS_PER_PAGE = int(os.getenv("REVIEWS_PER_PAGE", 20))
+
+# default and maximum number of search results on a page
+SEARCH_PER_PAGE = int(os.getenv("SEARCH_PER_PAGE", 30))
+SEARCH_MAX_PER_PAGE = 100
+
+# create the goodreads ratings provider, GOODREADS_CACHE is the file to save
+#   the cached ratings to
+ratings_provider = goodreads.RatingsProvider(
+    timeout=(1, float(os.getenv("GOODREADS_TIMEOUT", 2))),
+    path=os.getenv("GOODREADS_CACHE"))
+
+# ask goodreads on the book page if the rating isn't in the ratings table
+GOODREADS_LIVE = os.getenv("GOODREADS_LIVE", "1") == "1"
+
+# seconds the book page waits for goodreads before it shows "Not available"
+#   (the rating is still cached when it arrives later)
+GOODREADS_WAIT = float(os.getenv("GOODREADS_WAIT", 1))
+
+# ask goodreads at the same time as the database on the book page if
+#   BOOK_CONCURRENT=1, instead of only when the rating isn't stored
+BOOK_CONCURRENT = os.getenv("BOOK_CONCURRENT", "0") == "1"
+
+# threads for the external requests of the pages (IO_WORKERS)
+io_pool = futures.ThreadPoolExecutor(
+    max_workers=int(os.getenv("IO_WORKERS", 16)), thread_name_prefix="io")
+
+# isbn -> future of the goodreads requests which are running or waiting in
+#   the io pool, the book page shows "Not available" without asking when
+#   GOODREADS_BACKLOG requests are pending
+goodreads_pending = dict()
+goodreads_lock = threading.Lock()
+GOODREADS_BACKLOG = int(os.getenv("GOODREADS_BACKLOG", 64))
+
+# create the cache of the api responses (API_CACHE: memory or redis), a new
+#   review deletes the response of its book but only in the worker of the
+#   review, so the memory cache of every worker keeps it for API_CACHE_TTL
+#   seconds instead of a day
+if os.getenv("API_CACHE", "memory") == "redis":
+    api_cache = cache.RedisStore(cache.redis_client(), ttl=24 * 3600)
+else:
+    api_cache = cache.TTLCache(int(os.getenv("API_CACHE_SIZE", 10000)),
+                               ttl=float(os.getenv("API_CACHE_TTL", 60)))
+
+# maximum number of books in one request to /api/books
+API_BATCH_MAX = int(os.getenv("API_BATCH_MAX", 1000))
+
+# the export needs a logged on user or the EXPORT_TOKEN (for jobs), and at
+#   most EXPORT_MAX exports run at once because every export holds a
+#   connection of the pool until the client has read it
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN")
+export_slots = threading.BoundedSemaphore(int(os.getenv("EXPORT_MAX", 2)))
+
+# create the search index (it is filled before the first request)
+search_engine = search_index.SearchIndex()
+
+# keep a copy of the books table in memory if CATALOG=1, it is loaded again
+#   in the background every CATALOG_REFRESH seconds
+CATALOG = os.getenv("CATALOG", "0") == "1"
+CATALOG_REFRESH = float(os.getenv("CATALOG_REFRESH", 60))
+books_catalog = catalog.Catalog()
+catalog_loading = threading.Lock()
+
+# held while the search index is refreshed in the background
+search_loading = threading.Lock()
+
+# the store of the rate limit buckets (RATE_LIMIT_STORE: memory or redis)
+if os.getenv("RATE_LIMIT_STORE", "memory") == "redis":
+    rate_store = cache.RedisStore(cache.redis_client())
+else:
+    rate_store = cache.TTLCache(int(os.getenv("RATE_LIMIT_SIZE", 100000)))
+
+# the rate limits ("requests/seconds") of the login/register per ip address
+#   and per username and of the api per ip address
+login_ip_limit = ratelimit.RateLimiter(
+    rate_store, os.getenv("LOGIN_RATE_IP", "20/60"), "rate:login_ip:")
+login_user_limit = ratelimit.RateLimiter(
+    rate_store, os.getenv("LOGIN_RATE_USER", "5/60"), "rate:login_user:")
+api_limit = ratelimit.RateLimiter(
+    rate_store, os.getenv("API_RATE_IP", "300/60"), "rate:api_ip:")
+
+# the idempotency keys of the register form are kept in the same store
+idempotency_store = rate_store
+
+# write the reviews in batches in a background thread if REVIEW_QUEUE=1
+#   (at most REVIEW_BATCH reviews per batch, waiting at most
+#   REVIEW_INTERVAL seconds for more reviews)
+if os.getenv("REVIEW_QUEUE", "0") == "1":
+    review_writer = reviews.ReviewWriter(
+        db, batch_size=int(os.getenv("REVIEW_BATCH", 100)),
+        interval=float(os.getenv("REVIEW_INTERVAL", 0.5)),
+        on_commit=lambda added: reviews_written(added))
+    review_writer.start()
+    atexit.register(review_writer.stop)
+else:
+    review_writer = None
+
+# isbn -> id of the books (for the reviews)
+book_ids = cache.TTLCache(int(os.getenv("BOOK_ID_CACHE_SIZE", 100000)),
+                          ttl=24 * 3600)
+
+# create the prefix index of the search suggestions and the default and
+#   maximum number of suggestions
+suggest_index = suggest.PrefixIndex()
+suggest_loading = threading.Lock()
+SUGGEST_LIMIT = 10
+SUGGEST_MAX_LIMIT = 50
+
+# keep the compiled templates (TEMPLATE_CACHE_DIR, default a temporary
+#   directory) so new workers don't compile them again
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+    os.getenv("TEMPLATE_CACHE_DIR"))
+
+# cache of rendered parts of the pages (the book details/reviews and the
+#   search results), the key contains the version of the data
+fragment_cache = cache.TTLCache(int(os.getenv("FRAGMENT_CACHE_SIZE", 10000)),
+                                ttl=3600)
+
+
+def cached_fragment(key, render, ttl=None):
+    """
+    gives a rendered part of a page from the fragment cache or renders it
+
+    parameters:
+        key    - is the key of the fragment (with the version of its data)
+        render - is a function which renders the fragment
+        ttl    - is the time to live in seconds (None for the default)
+
+    returns the html of the fragment (safe to put in a template)
+    """
+
+    html = fragment_cache.get(key, None)
+    if html is None:
+        html = render()
+        fragment_cache.set(key, html, ttl)
+
+    return Markup(html)
+
+
+@app.before_first_request
+def setup_search():
+    """
+    builds the search index, the suggestion index and the catalog (if
+        CATALOG=1) from the books table
+    """
+
+    if SEARCH_BACKEND == "index":
+        search_engine.build(db)
+
+    suggest_index.build(db)
+
+    if CATALOG:
+        books_catalog.load(db)
+
+
+def refresh_search():
+    """
+    brings the search index up to date with the books table (in a thread of
+        the io pool)
+    """
+
+    try:
+        search_engine.refresh(db)
+    finally:
+        db.remove()
+        search_loading.release()
+
+
+def build_suggest():
+    """
+    rebuilds the suggestion index (in a thread of the io pool)
+    """
+
+    try:
+        suggest_index.build(db)
+    finally:
+        db.remove()
+        suggest_loading.release()
+
+
+def load_catalog():
+    """
+    loads the catalog again (in a thread of the io pool)
+    """
+
+    try:
+        books_catalog.load(db)
+    finally:
+        db.remove()
+        catalog_loading.release()
+
+
+def find_book(isbn):
+    """
+    gives a book with its stored goodreads rating from the catalog (if
+        CATALOG=1) or else from the database
+
+    parameters:
+        isbn - is the isbn of the book
+
+    returns the book or None if it isn't found
+    """
+
+    if CATALOG:
+
+        # load the catalog again in the background if it is old
+        if time.monotonic() - books_catalog.loaded > CATALOG_REFRESH and \
+                catalog_loading.acquire(blocking=False):
+            io_pool.submit(load_catalog)
+
+        # books added after the catalog was loaded are in the database
+        book = books_catalog.get(isbn)
+        if book is not None:
+            return book
+
+    return db.execute("SELECT books.*, "
+                      "ratings.average_rating AS gr_average, "
+                      "ratings.ratings_count AS gr_count, "
+                      "ratings.fetched_at AS gr_fetched "
+                      "FROM books "
+                      "LEFT JOIN ratings ON ratings.isbn=books.isbn "
+                      "WHERE books.isbn=:isbn", {"isbn": isbn}).fetchone()
 
 
 @app.before_request
+def check_rate_limits():
+    """
+    limits the posts to /login and /register per ip address and username
+        and the requests to /api/<isbn>, /api/books and /api/export per ip
+        address (token buckets, see functions/ratelimit.py)
+
+    a request to /api/books takes a token per isbn (at most a full bucket)
+        and an export, which gives all books, takes the full bucket
+
+    aborts if:
+        - a bucket is empty (429 with a Retry-After header)
+    """
+
+    if request.endpoint in ("login", "register") and \
+            request.method == "POST":
+        username = request.form.get("username") or \
+            request.form.get("register_username") or ""
+        wait = login_ip_limit.hit(request.remote_addr) or \
+            login_user_limit.hit(username.lower())
+    elif request.endpoint == "api":
+        wait = api_limit.hit(request.remote_addr)
+    elif request.endpoint == "api_books":
+        wait = api_limit.hit(request.remote_addr,
+                             min(len(requested_isbns()), api_limit.burst))
+    elif request.endpoint == "api_export":
+        wait = api_limit.hit(request.remote_addr, api_limit.burst)
+    else:
+        return
+
+    if wait:
+        metrics.inc("rate_limited_total", endpoint=request.endpoint)
+        raise TooManyRequests(retry_after=math.ceil(wait))
+
+
 def setup_urls():
     """
     create a dictionary for the navbar items
+
+    returns the dictionary with endpoint -> [title, login required]
     """
 
     # get all routes in the app
@@ -59,18 +398,18 @@ def setup_urls():
     # create an empty dictionary
     url_list = dict()
 
+    # define the routes excluded and only available if logged on
+    forbidden = ["log", "static", "register", "api", "book", "metrics"]
+    login_req = ["search"]
+
     # iterate over all routes in the app
     for url in urls:
 
         # filter for routes with a "GET" method
-        if "GET" in url.get_empty_kwargs()["methods"]:
+        if "GET" in url.methods:
 
             # get the endpoint of the route
-            endpoint = url.get_empty_kwargs()["endpoint"]
-
-            # define the routes excluded and only available if logged on
-            forbidden = ["log", "static", "register", "api", "book"]
-            login_req = ["search"]
+            endpoint = url.endpoint
 
             # check if allowed
             allowed = not any(item in endpoint for item in forbidden)
@@ -88,10 +427,29 @@ def setup_urls():
                 url_list[endpoint] = [endpoint.capitalize(), None]
 
     # sort dictionary by key
-    url_list = dict(sorted(url_list.items(), key=lambda x: x[0]))
+    return dict(sorted(url_list.items(), key=lambda x: x[0]))
+
+
+# the navbar items and the number of routes they were made for
+navbar = {"rules": 0, "urls": dict()}
+
+
+@app.context_processor
+def navbar_urls():
+    """
+    adds the navbar items to every template, they are only made again if
+        the routes of the app changed
 
-    # add url_list to session
-    session["urls"] = url_list
+    returns a dictionary with the urls for the template
+    """
+
+    # make the navbar again if a route was added
+    rules = len(app.url_map._rules)
+    if navbar["rules"] != rules:
+        navbar["urls"] = setup_urls()
+        navbar["rules"] = rules
+
+    return {"urls": navbar["urls"]}
 
 
 @app.route("/", methods=["GET"])
@@ -105,9 +463,6 @@ def index():
     returns the homepage with parameters if logged on
     """
 
-    # get user list from session
-    url_list = session.get("urls")
-
     # check if someone is logged on
     if "username" in session:
 
@@ -118,10 +473,9 @@ def index():
 
     # check if request is a "GET" request
     if request.method == "GET" and user:
-        return render_template("index.html", login=True, user=user,
-                               urls=url_list)
+        return render_template("index.html", login=True, user=user)
     elif request.method == "GET":
-        return render_template("index.html", urls=url_list)
+        return render_template("index.html")
 
     # abort using a 405 HTTPException
     abort(405)
@@ -133,9 +487,11 @@ def register():
     register a new user
 
     aborts if:
-        - a user is already registering (403)
+        - the same form is already being submitted (409)
         - no username/password/retype password is given (400)
         - user already registered (400)
+        - too many registrations of the ip address or username (429)
+        - the hashing pool is too busy (503)
         - request is anything else than "POST" or "GET" (405)
 
     returns the register form again if the retype password and password
@@ -143,18 +499,18 @@ def register():
         was successfull it redirects (303) to "/".
     """
 
-    # get url list from session
-    url_list = session.get("urls")
-
     # check if request was a "POST" request
     if request.method == "POST":
 
-        # check if user is already registering if so abort 403
-        if session.get("register_user") is not None:
-
-            # remove registering user from session
-            session.pop("register_user", None)
-            abort(403, "Detected double submission of form please try again")
+        # the form has a random key, a second submission of the same form
+        #   gets the result of the first one
+        key = (request.form.get("idempotency_key") or "")[:64]
+        if key:
+            state = idempotency_store.get(f"register:{key}", None)
+            if state == "done":
+                return redirect("/", 303)
+            elif state == "busy":
+                abort(409, "This form is already being submitted")
 
         # get all values from the submitted form
         username = escape(request.form.get("register_username"))
@@ -164,7 +520,8 @@ def register():
         # if the given passwords aren't the same rerender the template
         if password != rpassword:
             return render_template("register.html", message="passwords weren't"
-                                   " the same...", urls=url_list)
+                                   " the same...",
+                                   idempotency_key=os.urandom(16).hex())
 
         # if no username/password/retype password were given abort (400)
         if not username or not password or not rpassword:
@@ -172,37 +529,50 @@ def register():
             # abort using a 400 HTTPException
             abort(400, "No username/password specified")
 
-        session["register_user"] = username
-
-        # search database for user
-        user = db.execute("SELECT * FROM accounts "
-                          "WHERE username=:username",
-                          {"username": username}).fetchall()
-
-        # if username was found in the database abort (400)
-        if len(user) >= 1:
+        if key:
+            idempotency_store.set(f"register:{key}", "busy", 600)
 
-            # abort using a 400 HTTPException
-            abort(400, "User already registered")
-
-        # hash password
-        password = security.hash_psswd(password)
-
-        # add username and password to database and commit
-        db.execute("INSERT INTO accounts (username, password) "
-                   "VALUES (:username, :password)",
-                   {"username": username, "password": password})
-        db.commit()
+        try:
 
-        # remove registering user from session
-        session.pop("register_user", None)
+            # hash password (in the hashing pool, 503 if it is too busy)
+            try:
+                password = security.hash_async(password)
+            except security.HashingBusy as error:
+                abort(503, str(error))
+
+            # add the account unless the username is taken (by the unique
+            #   index, so two registrations at the same time can't both
+            #   succeed)
+            account = db.execute("INSERT INTO accounts (username, password) "
+                                 "VALUES (:username, :password) "
+                                 "ON CONFLICT (username) DO NOTHING "
+                                 "RETURNING id",
+                                 {"username": username,
+                                  "password": password}).fetchone()
+            db.commit()
+
+            # if username was already in the database abort (400)
+            if account is None:
+
+                # abort using a 400 HTTPException
+                abort(400, "User already registered")
+
+        # the form can be submitted again if it failed
+        except Exception:
+            if key:
+                idempotency_store.delete(f"register:{key}")
+            raise
+
+        if key:
+            idempotency_store.set(f"register:{key}", "done", 3600)
 
         return redirect("/", 303)
 
     # check if request was a "GET" request
     elif request.method == "GET":
 
-        return render_template("register.html", urls=url_list)
+        return render_template("register.html",
+                               idempotency_key=os.urandom(16).hex())
 
     # abort using a 405 HTTPException
     abort(405)
@@ -215,8 +585,9 @@ def login():
 
     aborts if:
         - no username/password is specified (400)
-        - the database gives more or less than 1 account back (401)
-        - the credentials are invalid (401)
+        - the username is unknown or the credentials are invalid (401)
+        - too many logins of the ip address or username (429)
+        - the hashing pool is too busy (503)
         - method is anthing else than POST (405)
 
     returns a redirect (303) to "/"
@@ -233,7 +604,7 @@ def login():
         password = escape(request.form.get("password"))
 
         # find user in database
-        user = db.execute("SELECT password, username FROM accounts "
+        user = db.execute("SELECT id, password, username FROM accounts "
                           "WHERE username=:username",
                           {"username": username}).fetchall()
 
@@ -243,18 +614,37 @@ def login():
             # abort using a 400 HTTPException
             abort(400, "No username/password specified")
 
-        # check if the username returns more or less 1 user in database
-        if len(user) != 1:
-            # abort using a 401 HTTPException
-            abort(401, "Multiple/No entries of the same user found, try again")
-            return redirect("/", 303)
-
         # check if the given password matches the one from the databes
-        login_validity = security.compare_hash(user[0].password, password)
+        #   (in the hashing pool, 503 if it is too busy), an unknown user
+        #   isn't hashed but takes the same time and gives the same error
+        try:
+            if len(user) == 1:
+                login_validity = security.compare_async(user[0].password,
+                                                        password)
+            else:
+                login_validity = security.compare_unknown()
+        except security.HashingBusy as error:
+            abort(503, str(error))
 
         # if it is the same as in the database add username to the session
         if login_validity is True:
             session["username"] = username
+            session["user_id"] = user[0].id
+
+            # hash the password again if the hash is outdated, unless the
+            #   hashing pool is busy (then it is done at a next login)
+            if security.needs_rehash(user[0].password):
+                try:
+                    psswd_hash = security.hash_async(password, wait=0)
+                except security.HashingBusy:
+                    psswd_hash = None
+
+                if psswd_hash is not None:
+                    db.execute("UPDATE accounts SET password=:password "
+                               "WHERE username=:username",
+                               {"username": username,
+                                "password": psswd_hash})
+                    db.commit()
         else:
 
             # abort using a 401 HTTPException
@@ -284,8 +674,9 @@ def logout():
     # check if request is a "GET" request
     if request.method == "GET":
 
-        # remove username from session
+        # remove username and user id from session
         session.pop("username", None)
+        session.pop("user_id", None)
 
         return redirect("/", code=303)
 
@@ -305,9 +696,6 @@ def search():
     it returns the search page
     """
 
-    # get the url list from the session
-    url_list = session.get("urls")
-
     # check if someone is logged on
     if "username" in session:
 
@@ -323,31 +711,30 @@ def search():
         search_query = str(request.args.get("search"))
 
         # split the query into single words (escape the query)
-        search = re.split(r'\W+', search_query)
-
-        # predefine an empty list for the results
-        results = []
-
-        # search each word in the database
-        for query in search:
-
-            # exclude any escaped words
-            if query:
-
-                # search in the columns of the book database for the query
-                db_res = db.execute("SELECT * FROM books WHERE (title ILIKE "
-                                    f"'%{query}%' or author ILIKE '%{query}%'"
-                                    f" or isbn ILIKE '%{query}%')").fetchall()
-
-                # add all items to the result list
-                for db_result in db_res:
-
-                    # make sure noe doubles added to the results
-                    if db_result not in results:
-                        results.append(db_result)
+        search = search_index.split_query(search_query)
+
+        # get the requested page (the cursor "after" is used if given)
+        page = max(request.args.get("page", 1, type=int), 1)
+        per_page = min(max(request.args.get("per_page", SEARCH_PER_PAGE,
+                                            type=int), 1),
+                       SEARCH_MAX_PER_PAGE)
+        after = request.args.get("after")
+
+        # find books with any of the words or (with match=all) all words
+        match_all = request.args.get("match") == "all"
+
+        # the results are the same for the same words, the fragment is kept
+        #   until the index/database is searched again for new books
+        words = " ".join(search)
+        results = cached_fragment(
+            f"search:{words}:{match_all}:{page}:{per_page}:{after}",
+            lambda: search_fragment(search, words, page, per_page, after,
+                                    match_all),
+            SEARCH_REFRESH)
 
         return render_template("search.html", login=True, user=user,
-                               urls=url_list, results=results)
+                               results=results, query=search_query,
+                               match_all=match_all)
 
     # abort if not logged on
     elif not user:
@@ -357,42 +744,295 @@ def search():
     abort(405)
 
 
-def goodreads_api(url):
+def search_fragment(search, words, page, per_page, after=None,
+                    match_all=False):
+    """
+    searches the words in the index or in the database and renders the
+        results (see search_results.html)
+
+    parameters:
+        search    - is a list of normalized words to search for
+        words     - is the search query made of the normalized words
+        page      - is the number of the page to show
+        per_page  - is the number of results on a page
+        after     - is the cursor of the last result of the previous page
+        match_all - only give the books where all words are found
+
+    returns the html of the results
+    """
+
+    if SEARCH_BACKEND == "index":
+        results, total, cursor = search_books(search, page, per_page, after,
+                                              match_all)
+    else:
+        results, total, cursor = search_database(search, page, per_page,
+                                                 after, match_all)
+
+    return render_template("search_results.html", results=results,
+                           total=total, query=words, page=page,
+                           per_page=per_page, cursor=cursor,
+                           match="all" if match_all else None)
+
+
+def search_books(search, page, per_page, after=None, match_all=False):
+    """
+    searches the words in the search index and ranks the results
+
+    parameters:
+        search    - is a list of normalized words to search for
+        page      - is the number of the page to show
+        per_page  - is the number of results on a page
+        after     - is the cursor of the last result of the previous page
+        match_all - only give the books where all words are found
+
+    returns a tuple with a list of the books on the page (best first), the
+        total number of results and the cursor of the next page
+    """
+
+    # update the index in the background with the books which were added,
+    #   changed or deleted since the last refresh
+    if time.monotonic() - search_engine.refreshed > SEARCH_REFRESH and \
+            search_loading.acquire(blocking=False):
+        io_pool.submit(refresh_search)
+
+    # get the ids of the found books on this page from the index
+    ranked = search_engine.rank(search, match_all)
+    book_ids, cursor = search_index.paginate(ranked, page, per_page, after)
+
+    # no need to ask the database if nothing was found
+    if not book_ids:
+        return [], len(ranked), None
+
+    # get the books on this page from the catalog (if CATALOG=1) and the
+    #   others from the database
+    books = books_catalog.get_ids(book_ids) if CATALOG else dict()
+    missing = [book_id for book_id in book_ids if book_id not in books]
+    if missing:
+        query = text("SELECT * FROM books WHERE id IN :ids") \
+            .bindparams(bindparam("ids", expanding=True))
+        books.update((book.id, book) for book in
+                     db.execute(query, {"ids": missing}).fetchall())
+
+    # put the books in the ranked order
+    results = [books[book_id] for book_id in book_ids if book_id in books]
+
+    return results, len(ranked), cursor
+
+
+def search_database(search, page, per_page, after=None, match_all=False):
+    """
+    searches the words in the books table of the database and ranks the
+        results with one query with bound parameters
+
+    parameters:
+        search    - is a list of normalized words to search for
+        page      - is the number of the page to show
+        per_page  - is the number of results on a page
+        after     - is the cursor of the last result of the previous page
+        match_all - only give the books where all words are found
+
+    returns a tuple with a list of the books on the page (best first), the
+        total number of results and the cursor of the next page
+    """
+
+    # no words means no results
+    if not search:
+        return [], 0, None
+
+    # sqlite has no ILIKE (its LIKE ignores case of ascii letters)
+    like = "ILIKE" if engine.dialect.name == "postgresql" else "LIKE"
+
+    # a condition for every word in every column and the score of it (see
+    #   search_index.score), the % and _ in a word are escaped
+    params = dict()
+    matches = []
+    scores = []
+    for number, word in enumerate(search):
+        params[f"word{number}"] = "%" + re.sub(r"([\\%_])", r"\\\1",
+                                               word) + "%"
+        found = [f"{field} {like} :word{number} ESCAPE '\\'"
+                 for field in search_index.FIELDS]
+        matches.append("(" + " OR ".join(found) + ")")
+        scores.extend(f"CASE WHEN {condition} THEN {weight} ELSE 0 END"
+                      for condition, weight in zip(found,
+                                                   search_index.WEIGHTS))
+
+    # continue after the cursor (keyset pagination) or at the page number
+    last = search_index.parse_cursor(after) if after else None
+    if last is not None:
+        keyset = "WHERE score < :score OR (score = :score AND id > :id)"
+        params.update(score=-last[0], id=last[1], offset=0)
+    else:
+        keyset = ""
+        params["offset"] = (page - 1) * per_page
+
+    # one more result than the page to know if there is a next page
+    params["limit"] = per_page + 1
+
+    # the books with any (or all) words, their score and the number of
+    #   found books, best first
+    where = (" AND " if match_all else " OR ").join(matches)
+    rows = db.execute(f"SELECT * FROM (SELECT books.*, "
+                      f"{' + '.join(scores)} AS score, "
+                      f"COUNT(*) OVER () AS total FROM books WHERE {where}"
+                      f") AS found {keyset} ORDER BY score DESC, id "
+                      f"LIMIT :limit OFFSET :offset", params).fetchall()
+
+    results = rows[:per_page]
+    total = rows[0].total if rows else 0
+
+    # the cursor of the next page is the key of the last result on this page
+    if len(rows) > per_page:
+        cursor = f"{results[-1].score}:{results[-1].id}"
+    else:
+        cursor = None
+
+    return results, total, cursor
+
+
+def goodreads_api(isbn):
     """
     gets the average rating and review count from goodreads
-    when given the api url
+    when given the isbn, the result is cached by the ratings provider
 
     parameters:
-        url - is the api url for goodreads
+        isbn - is the isbn of the book
 
     it returns a list with the avg rating and rating count
+        or None if not available
+    """
+
+    return ratings_provider.rating(isbn)
+
+
+def find_book_id(isbn):
     """
+    gives the id of a book from the catalog (if CATALOG=1), the cache or
+        the database
 
-    # if there can be made a connection to the goodreads api get te values
-    if requests.get(url).status_code == 200:
+    parameters:
+        isbn - is the isbn of the book
 
-        # get the goodreads api values
-        gr_data = requests.get(url)
+    returns the id or None if the book isn't found
+    """
 
-        # convert the json data to dictionary
-        data = json.loads(gr_data.text)
+    book = books_catalog.get(isbn) if CATALOG else None
+    if book is not None:
+        return book.id
 
-        # get the average_rating and ratings_count
-        gr_ar = data["books"][0]["average_rating"]
-        gr_nor = data["books"][0]["ratings_count"]
+    book_id = book_ids.get(isbn, None)
+    if book_id is None:
+        book_id = db.execute("SELECT id FROM books WHERE isbn=:isbn",
+                             {"isbn": isbn}).scalar()
+        if book_id is not None:
+            book_ids.set(isbn, book_id)
 
-        # make a list with those values
-        goodreads = [gr_ar, gr_nor]
+    return book_id
 
-        # if the rating or count is 0 give goodreads the value none instead
-        if gr_ar == "0.0" or gr_nor == 0:
-            goodreads = None
 
-    # if no connection could be made, give goodreads a null value
-    else:
-        goodreads = None
+def find_user_id():
+    """
+    gives the id of the logged on user from the session (sessions from
+        before the id was stored get it from the database)
+
+    returns the id or None if the account doesn't exist
+    """
+
+    if "user_id" not in session:
+        session["user_id"] = db.execute("SELECT id FROM accounts "
+                                        "WHERE username=:username",
+                                        {"username": session["username"]}
+                                        ).scalar()
 
-    return goodreads
+    return session["user_id"]
+
+
+def reviews_written(added):
+    """
+    clears the cached data of the books which got a review (the cached
+        fragments of the book page have the review count as version, so
+        they are replaced by the new count)
+
+    parameters:
+        added - is a list of the added reviews
+    """
+
+    for review in added:
+        api_cache.delete(f"api:{review.isbn}")
+        suggest_index.add_review(review.isbn)
+        books_catalog.add_review(review.isbn, review.rating)
+
+
+def ask_goodreads(isbn):
+    """
+    starts goodreads_api() for an isbn in the io pool, or gives the request
+        which is already pending for the isbn (so more views of a book make
+        one request)
+
+    parameters:
+        isbn - is the isbn of the book
+
+    returns the future of goodreads_api() or None if GOODREADS_BACKLOG
+        requests are pending
+    """
+
+    with goodreads_lock:
+        future = goodreads_pending.get(isbn)
+        if future is not None:
+            return future
+
+        if len(goodreads_pending) >= GOODREADS_BACKLOG:
+            metrics.inc("goodreads_skipped_total")
+            return None
+
+        future = goodreads_pending[isbn] = io_pool.submit(goodreads_api,
+                                                          isbn)
+
+    # forget the request when it is done (outside the lock, a future which
+    #   is already done calls back at once)
+    future.add_done_callback(lambda done: forget_goodreads(isbn))
+
+    return future
+
+
+def forget_goodreads(isbn):
+    """
+    removes a done goodreads request from the pending requests
+
+    parameters:
+        isbn - is the isbn of the book
+    """
+
+    with goodreads_lock:
+        goodreads_pending.pop(isbn, None)
+
+
+def wait_goodreads(future):
+    """
+    waits at most GOODREADS_WAIT seconds for a rating from goodreads_api()
+        which runs in the io pool
+
+    parameters:
+        future - is the future of ask_goodreads() (None if goodreads wasn't
+                 asked)
+
+    returns the rating or None if it didn't arrive in time
+    """
+
+    if future is None:
+        return None
+
+    start = time.perf_counter()
+
+    try:
+        return future.result(timeout=GOODREADS_WAIT)
+    except futures.TimeoutError:
+        metrics.inc("goodreads_timeouts_total")
+        return None
+
+    # the request runs in an other thread, so add the waited time here
+    finally:
+        metrics.add_timing("ext", time.perf_counter() - start)
 
 
 @app.route("/<isbn>", methods=["GET", "POST"])
@@ -402,19 +1042,18 @@ def book(isbn):
     adds review to database if "POST" request
 
     aborts if:
-        - got more than 1 book for given isbn (401)
         - found no books for given isbn (404)
         - user tries to submit review under other name than logged on (403)
         - not logged on (403)
         - method not "GET" or "POST" (405)
         - user tries to sumbit second review to book (403)
 
+    shows REVIEWS_PER_PAGE reviews, the page is selected with the page
+        parameter
+
     redirects to itself after submission of review
     """
 
-    # get url list from the session
-    url_list = session.get("urls")
-
     # check if someone is logged on
     if "username" in session:
 
@@ -426,33 +1065,47 @@ def book(isbn):
     # check if request is a "GET" request and user logged on
     if request.method == "GET" and user:
 
-        # get books/reviews for this isbn and all users
-        books = db.execute("SELECT * FROM books WHERE isbn=:isbn",
-                           {"isbn": isbn}).fetchall()
-        reviews = db.execute("SELECT * FROM reviews JOIN books ON "
-                             "reviews.book_id = books.id WHERE isbn=:isbn",
-                             {"isbn": isbn}).fetchall()
-        users = db.execute("SELECT username FROM accounts").fetchall()
-
-        # define url for the goodreads api with this isbn
-        URL = "https://www.goodreads.com/book/review_counts.json?key=" \
-            f"4cWZI3ifMz0RSj1NFaYiBQ&isbns={isbn}"
-
-        goodreads = goodreads_api(URL)
-
-        # if there are more than 1 book for the same isbn abort
-        if len(books) > 1:
-            abort(400)
-        # 404 abort if none are found
-        elif len(books) == 0:
+        # get the requested page of the reviews
+        page = max(request.args.get("page", 1, type=int), 1)
+
+        # start asking goodreads while the database is asked
+        if BOOK_CONCURRENT and GOODREADS_LIVE:
+            rating = ask_goodreads(isbn)
+        else:
+            rating = None
+
+        # get the book with its stored goodreads rating
+        book = find_book(isbn)
+
+        # 404 abort if the book isn't found
+        if book is None:
             abort(404)
 
-        # get first item in the books list (got list from database fetch)
-        book = books[0]
+        # the review count is the version of the rendered details and
+        #   reviews, a new review changes it so they are rendered again
+        version = book.review_count or 0
+        details = cached_fragment(
+            f"book:{isbn}:{version}",
+            lambda: render_template("book_details.html", book=book))
+        review_page = cached_fragment(
+            f"book:{isbn}:{version}:{page}",
+            lambda: reviews_fragment(book, page))
+
+        # use the stored goodreads rating (see functions/ratings.py) or
+        #   ask goodreads if it wasn't fetched yet, a slow goodreads gives
+        #   "Not available" after GOODREADS_WAIT seconds
+        if book.gr_fetched is not None:
+            goodreads = [book.gr_average, book.gr_count] \
+                if book.gr_count else None
+        elif GOODREADS_LIVE:
+            goodreads = wait_goodreads(
+                rating if BOOK_CONCURRENT else ask_goodreads(isbn))
+        else:
+            goodreads = None
 
-        return render_template("book.html", book=book, reviews=reviews,
-                               users=users, login=True, user=user,
-                               urls=url_list, goodreads=goodreads)
+        return render_template("book.html", book=book, details=details,
+                               reviews=review_page, login=True, user=user,
+                               goodreads=goodreads)
 
     # check if request is a "POST" request
     elif request.method == "POST" and user:
@@ -476,34 +1129,32 @@ def book(isbn):
         except TypeError:
             abort(400, "Rating must be a number")
 
-        # look in database if user review is already present of this user
-        user_check = db.execute("SELECT * FROM reviews WHERE user_id=("
-                                "SELECT id FROM accounts WHERE username="
-                                ":username) and book_id=(SELECT id FROM "
-                                "books WHERE isbn=:isbn)",
-                                {"username": username,
-                                 "isbn": isbn}).fetchall()
+        # get the ids of the user and the book without sub-selects
+        review = reviews.Review(user_id=find_user_id(),
+                                book_id=find_book_id(isbn), isbn=isbn,
+                                rating=rating_value, text=review_text)
 
-        # abort user tries to review more then once on the same book
-        if len(user_check) != 0:
-            abort(403, "You can't review more than once.")
+        # 404 abort if the book (or account) isn't found
+        if review.book_id is None or review.user_id is None:
+            abort(404)
 
-        # add review to database
-        db.execute("INSERT INTO reviews (user_id, rating, text, book_id) "
-                   "VALUES ((SELECT id from accounts where "
-                   "username=:username), :rating, :text, (SELECT id from "
-                   "books where isbn=:isbn))",
-                   {"username": username, "rating": rating,
-                    "text": review_text, "isbn": isbn})
+        # queue the review for the background writer (REVIEW_QUEUE=1), it
+        #   is written now if the queue is full
+        if review_writer is not None and review_writer.submit(review):
+            return redirect(f"/{isbn}", 303)
 
-        # update book after review has been submitted
-        db.execute("UPDATE books SET (review_count, average_score)="
-                   "(SELECT COUNT(*), AVG(rating) FROM reviews "
-                   "WHERE book_id=(SELECT id FROM books WHERE isbn=:isbn))"
-                   " WHERE isbn=:isbn", {"isbn": isbn})
+        # add the review and update the running count/sum/average of the
+        #   book in one transaction, the unique index on the reviews per
+        #   user and book skips a second review
+        added = reviews.write_reviews(db, [review])
 
-        # commit to database
-        db.commit()
+        # abort user tries to review more then once on the same book
+        if not added:
+            abort(403, "You can't review more than once.")
+
+        # the api response, suggestion ranking and catalog of the book
+        #   changed
+        reviews_written(added)
 
         return redirect(f"/{isbn}", 303)
 
@@ -515,15 +1166,48 @@ def book(isbn):
     abort(405)
 
 
+def reviews_fragment(book, page):
+    """
+    gets one page of the reviews of a book with their usernames and renders
+        them (see book_reviews.html)
+
+    parameters:
+        book - is the row of the book from the database
+        page - is the number of the page of the reviews
+
+    returns the html of the reviews
+    """
+
+    reviews = db.execute("SELECT reviews.id, reviews.rating, reviews.text, "
+                         "accounts.username FROM reviews "
+                         "LEFT JOIN accounts ON accounts.id=reviews.user_id "
+                         "WHERE reviews.book_id=:book_id ORDER BY reviews.id "
+                         "LIMIT :limit OFFSET :offset",
+                         {"book_id": book.id, "limit": REVIEWS_PER_PAGE,
+                          "offset": (page - 1) * REVIEWS_PER_PAGE}).fetchall()
+
+    # check if there are more reviews after this page
+    more = page * REVIEWS_PER_PAGE < (book.review_count or 0)
+
+    return render_template("book_reviews.html", book=book, reviews=reviews,
+                           page=page, more=more)
+
+
 @app.route("/api/<isbn>", methods=["GET"])
 def api(isbn):
     """
     creates the api for the web application
 
+    the json is cached by isbn (until a review is added, or for at most
+        API_CACHE_TTL seconds in the memory cache) together with its ETag,
+        so a client with the same version gets a 304 response without
+        asking the database (there is no Last-Modified, the books have no
+        time of their last change)
+
     aborts if:
         - the resquest is anything else than a "GET" request
-        - somehow there are more than one entry of 1 isbn (401)
         - isbn not found in database (404)
+        - too many requests of the ip address (429)
 
 
     returns a json version of the book data
@@ -532,29 +1216,282 @@ def api(isbn):
     # check if request is a "GET" request
     if request.method == "GET":
 
-        # get book with the isbn from the database
-        books = db.execute("SELECT * FROM books WHERE isbn=:isbn",
-                           {"isbn": isbn}).fetchall()
+        # get the cached response or make it from the database
+        cached = api_cache.get(f"api:{isbn}", None)
+        if cached is None:
+            cached = api_response(isbn)
+            api_cache.set(f"api:{isbn}", cached)
 
-        # if there are more than 1 book for the same isbn abort
-        if len(books) > 1:
-            abort(401)
-        # 404 abort if none are found
-        elif len(books) == 0:
-            abort(404)
+        response = Response(cached["body"], mimetype="application/json")
+        response.set_etag(cached["etag"])
+
+        # gives 304 if the client already has this version
+        return response.make_conditional(request)
+
+    # abort using a 405 HTTPException
+    abort(405)
+
+
+def book_json(book):
+    """
+    gives the data of a book for the api
+
+    parameters:
+        book - is the row of the book from the database
+
+    returns a dictionary with the book data
+    """
+
+    # average_score must be a #.# type so used formatted string
+    if book.average_score is not None:
+        average_score = f"{book.average_score:.1f}"
+    else:
+        average_score = None
 
-        # get first item in the books list (got list from database fetch)
-        book = books[0]
+    return {"title": book.title, "author": book.author, "year": book.year,
+            "isbn": book.isbn, "review_count": book.review_count,
+            "average_score": average_score}
 
-        # average_score must be a #.# type so used formatted string
-        return jsonify(title=book.title, author=book.author, year=book.year,
-                       isbn=book.isbn, review_count=book.review_count,
-                       average_score=f"{book.average_score:.1f}")
+
+def api_response(isbn):
+    """
+    makes the json of the api from the database
+
+    parameters:
+        isbn - is the isbn of the book
+
+    aborts if:
+        - isbn not found in database (404)
+
+    returns a dictionary with the json (body) and its etag
+    """
+
+    # get book with the isbn from the catalog or the database
+    book = find_book(isbn)
+
+    # 404 abort if none are found
+    if book is None:
+        abort(404)
+
+    body = json.dumps(book_json(book), separators=(",", ":")) + "\n"
+
+    return {"body": body, "etag": hashlib.sha1(body.encode()).hexdigest()}
+
+
+@app.route("/api/suggest", methods=["GET"])
+def api_suggest():
+    """
+    gives search suggestions for the text typed so far (?q=...) from the
+        in-memory prefix index, without asking the database
+
+    ?limit= sets the number of suggestions (at most SUGGEST_MAX_LIMIT)
+
+    returns a json list with the isbn, title, author, review count and url
+        of the books, the books with the most reviews first
+    """
+
+    # rebuild the index in the background every SEARCH_REFRESH seconds for
+    #   the new books, the old index is used until the new one is ready
+    if time.monotonic() - suggest_index.refreshed > SEARCH_REFRESH and \
+            suggest_loading.acquire(blocking=False):
+        io_pool.submit(build_suggest)
+
+    limit = min(max(request.args.get("limit", SUGGEST_LIMIT, type=int), 1),
+                SUGGEST_MAX_LIMIT)
+    suggestions = suggest_index.suggest(request.args.get("q", ""), limit)
+
+    for suggestion in suggestions:
+        suggestion["url"] = url_for("book", isbn=suggestion["isbn"])
+
+    response = Response(json.dumps(suggestions, separators=(",", ":")),
+                        mimetype="application/json")
+
+    # the same text gives the same suggestions for a while
+    response.cache_control.max_age = 60
+
+    return response
+
+
+def requested_isbns():
+    """
+    gives the isbns of a request to /api/books, from ?isbns=isbn,isbn,... or
+        the posted json list (or {"isbns": [...]})
+
+    aborts if:
+        - no isbns are given or the json is invalid (400)
+        - more than API_BATCH_MAX isbns are given (413)
+        - the request is anything else than "GET" or "POST" (405)
+
+    returns a list of the isbns without empty and double isbns
+    """
+
+    # get the isbns from the url or the posted json
+    if request.method == "GET":
+        isbns = request.args.get("isbns", "").split(",")
+    elif request.method == "POST":
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            data = data.get("isbns")
+        if not isinstance(data, list):
+            abort(400, "Post a json list of isbns")
+        isbns = [str(isbn) for isbn in data]
+    else:
+
+        # abort using a 405 HTTPException
+        abort(405)
+
+    # remove empty and double isbns (keeping the order)
+    isbns = list(dict.fromkeys(isbn.strip() for isbn in isbns if isbn.strip()))
+
+    if not isbns:
+        abort(400, "No isbns specified")
+    if len(isbns) > API_BATCH_MAX:
+        abort(413, f"At most {API_BATCH_MAX} isbns per request")
+
+    return isbns
+
+
+@app.route("/api/books", methods=["GET", "POST"])
+def api_books():
+    """
+    gives the api data of multiple books in one request, the isbns are given
+        as ?isbns=isbn,isbn,... or posted as a json list (or as
+        {"isbns": [...]})
+
+    aborts if:
+        - no isbns are given or the json is invalid (400)
+        - more than API_BATCH_MAX isbns are given (413)
+        - the request is anything else than "GET" or "POST" (405)
+        - too many isbns were asked by the ip address (429)
+
+    returns a json with the found books and the missing isbns
+    """
+
+    isbns = requested_isbns()
+
+    # get the books from the catalog (if CATALOG=1)
+    books = dict()
+    if CATALOG:
+        for isbn in isbns:
+            book = books_catalog.get(isbn)
+            if book is not None:
+                books[isbn] = book
+
+    # get all other books in one query
+    missing = [isbn for isbn in isbns if isbn not in books]
+    if missing:
+        query = text("SELECT * FROM books WHERE isbn IN :isbns") \
+            .bindparams(bindparam("isbns", expanding=True))
+        books.update((book.isbn, book) for book in
+                     db.execute(query, {"isbns": missing}).fetchall())
+
+    return Response(json.dumps({
+        "books": [book_json(books[isbn]) for isbn in isbns if isbn in books],
+        "missing": [isbn for isbn in isbns if isbn not in books]},
+        separators=(",", ":")) + "\n", mimetype="application/json")
+
+
+@app.route("/api/export", methods=["GET"])
+def api_export():
+    """
+    streams all books with their review count and average score, the
+        format is chosen with ?format=ndjson (default) or ?format=csv and
+        the export is compressed with ?gzip=1
+
+    a job can use the export without logging on with the header
+        "Authorization: Bearer <EXPORT_TOKEN>"
+
+    aborts if:
+        - the format is unknown (400)
+        - not logged on and no valid token is given (403)
+        - the request is anything else than a "GET" request (405)
+        - too many requests of the ip address (429)
+        - EXPORT_MAX exports are running (503)
+
+    returns a streamed response of the export
+    """
+
+    # check if request is a "GET" request
+    if request.method == "GET":
+
+        # check if someone is logged on or the token of the export is given
+        token = request.headers.get("Authorization", "")
+        if "username" not in session and not (
+                EXPORT_TOKEN and hmac.compare_digest(
+                    token, f"Bearer {EXPORT_TOKEN}")):
+            abort(403, "Log on or give the export token")
+
+        # get the format and compression
+        form = request.args.get("format", "ndjson")
+        compress = request.args.get("gzip") in ("1", "true")
+
+        if form not in ("ndjson", "csv"):
+            abort(400, "Format must be ndjson or csv")
+
+        mimetype = "text/csv" if form == "csv" else "application/x-ndjson"
+
+        # take a place for the export, it is given back when the response
+        #   is closed (also if the client stops reading)
+        if not export_slots.acquire(blocking=False):
+            abort(503, "Too many exports at the same time, try again later")
+
+        # stream the rows while they are read from the database
+        try:
+            response = Response(stream_with_context(
+                export.export(engine, form, compress)), mimetype=mimetype)
+        except Exception:
+            export_slots.release()
+            raise
+        response.call_on_close(export_slots.release)
+
+        # tell the client the export is compressed
+        filename = f"books.{form}"
+        if compress:
+            response.headers["Content-Encoding"] = "gzip"
+        response.headers["Content-Disposition"] = \
+            f"attachment; filename={filename}"
+
+        return response
 
     # abort using a 405 HTTPException
     abort(405)
 
 
+@app.route("/api/pool", methods=["GET"])
+def api_pool():
+    """
+    gives the state of the database connection pool for monitoring
+
+    returns a json with the pool size, checked out connections, overflow
+        and the time waited for connections
+    """
+
+    return Response(json.dumps(dbpool.pool_status(engine)) + "\n",
+                    mimetype="application/json")
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_page():
+    """
+    gives the latency histograms and counters of the app and the state of
+        the connection pool in the prometheus text format
+
+    returns the metrics as text
+    """
+
+    # add the numbers of the connection pool as gauges
+    gauges = {f"db_pool_{name}": value
+              for name, value in dbpool.pool_status(engine).items()
+              if isinstance(value, (int, float))}
+
+    # and the size of the catalog
+    if CATALOG:
+        gauges["catalog_books"] = len(books_catalog)
+
+    return Response(metrics.render(gauges),
+                    mimetype="text/plain; version=0.0.4")
+
+
 @app.errorhandler(HTTPException)
 def errorhandler(error):
     """
@@ -568,12 +1505,14 @@ def errorhandler(error):
         from UVA Mprog Programming 2 Module 10 - Web
     """
 
-    # get url list from session
-    url_list = session.get("urls")
-
     # split the error into the header and message (index, 0 header, 1 text)
     error_message = str(error).split(":")
 
+    # keep the Retry-After header of a 429 error
+    headers = dict()
+    if getattr(error, "retry_after", None) is not None:
+        headers["Retry-After"] = str(error.retry_after)
+
     # check if someone is logged on
     if "username" in session:
 
@@ -581,13 +1520,12 @@ def errorhandler(error):
         user = session.get("username")
 
         return render_template("error.html", header=error_message[0],
-                               message=error_message[1], login=True, user=user,
-                               urls=url_list), error.code
+                               message=error_message[1], login=True,
+                               user=user), error.code, headers
     else:
 
         return render_template("error.html", header=error_message[0],
-                               message=error_message[1], urls=url_list), \
-                               error.code
+                               message=error_message[1]), error.code, headers
 
 
 # https://github.com/pallets/flask/pull/2314
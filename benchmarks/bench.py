@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+bench.py seeds a local database with books (books.csv plus synthetic books),
+    accounts and reviews, stubs the goodreads api with a local server and
+    measures the search, book, api, login and register pages through the
+    flask test client with multiple threads
+
+usage (from the directory of application.py):
+    python benchmarks/bench.py [--books N] [--accounts N]
+                               [--reviews-per-book N] [--requests N]
+                               [--threads N] [--output results.json]
+
+    the results (throughput and p50/p95/p99 latency per page) are printed as
+        a table and written as json to --output, so runs before and after a
+        change can be compared
+
+references:
+    https://flask.palletsprojects.com/en/1.1.x/testing/
+"""
+
+# used imports
+import argparse
+import importlib
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# the directory of application.py
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the password of all seeded accounts
+PASSWORD = "password"
+
+
+class GoodreadsStub(BaseHTTPRequestHandler):
+    """
+    answers like the goodreads review_counts api with the same rating for
+        every isbn
+    """
+
+    def do_GET(self):
+        isbns = parse_qs(urlparse(self.path).query).get("isbns", [""])[0]
+        books = [{"isbn": isbn, "average_rating": "3.90",
+                  "ratings_count": 100} for isbn in isbns.split(",") if isbn]
+
+        body = json.dumps({"books": books}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub():
+    """
+    starts the goodreads stub server in a thread
+
+    returns the url of the stub
+    """
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), GoodreadsStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return f"http://127.0.0.1:{server.server_port}/book/review_counts.json"
+
+
+def synthetic_books(count, start, rng):
+    """
+    makes synthetic books with words of the real titles
+
+    parameters:
+        count - is the number of books
+        start - is the number of the first book (for unique isbns)
+        rng   - is the random generator
+
+    yields a dictionary per book
+    """
+
+    words = ["dark", "house", "night", "river", "king", "secret", "garden",
+             "war", "star", "love", "city", "winter", "stone", "fire", "road"]
+    names = ["Anna", "Michael", "Grant", "Smith", "Jones", "Lee", "Cooper",
+             "Feist", "Rowling", "King", "Brown", "Garcia"]
+
+    for number in range(start, start + count):
+        yield {"isbn": f"B{number:09d}",
+               "title": " ".join(rng.choice(words).capitalize()
+                                 for i in range(rng.randint(1, 4))),
+               "author": f"{rng.choice(names)} {rng.choice(names)}",
+               "year": rng.randint(1900, 2020)}
+
+
+def seed(db, dialect, args, rng):
+    """
+    creates the database and fills it with the books, accounts and reviews
+
+    parameters:
+        db      - is the database session
+        dialect - is the name of the database dialect
+        args    - are the command line arguments
+        rng     - is the random generator
+    """
+
+    # import.py can't be imported by name (import is a keyword)
+    loader = importlib.import_module("functions.import")
+    from functions import accounts
+
+    loader.migrate(db, dialect)
+
+    # the real books and then synthetic books up to the requested number
+    books = list(loader.read_books(os.path.join(ROOT, "books.csv")))
+    books = books[:args.books]
+    books += synthetic_books(args.books - len(books), len(books), rng)
+
+    for batch in loader.batches(books, 5000):
+        db.execute(loader.insert_query(None, False), batch)
+
+    # all accounts get the same hash so seeding doesn't take hours
+    accounts.provision(db, accounts.numbered_accounts(args.accounts, "user",
+                                                      PASSWORD),
+                       batch_size=5000, workers=1, same_hash=True)
+
+    # random reviews by different users for every book
+    per_book = min(args.reviews_per_book, args.accounts)
+    reviews = ({"user_id": user_id, "book_id": book_id,
+                "rating": rng.randint(1, 5), "text": "benchmark review"}
+               for book_id in range(1, args.books + 1)
+               for user_id in rng.sample(range(1, args.accounts + 1),
+                                         per_book))
+    for batch in loader.batches(reviews, 5000):
+        db.execute("INSERT INTO reviews (user_id, book_id, rating, text) "
+                   "VALUES (:user_id, :book_id, :rating, :text)", batch)
+
+    loader.reconcile(db)
+    db.commit()
+
+    return [book["isbn"] for book in books], \
+        sorted({word.lower() for book in books[:1000]
+                for word in book["title"].split() if len(word) > 3})
+
+
+def percentile(values, fraction):
+    """
+    gives a percentile of sorted values
+
+    parameters:
+        values   - is a sorted list of values
+        fraction - is the percentile as a fraction (e.g. 0.95)
+
+    returns the value at the percentile
+    """
+
+    if not values:
+        return None
+
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run_scenario(app, name, request, args, login):
+    """
+    runs one page with multiple threads, every thread has its own client
+
+    parameters:
+        app     - is the flask app
+        name    - is the name of the page
+        request - is a function (client, number, rng) -> response
+        args    - are the command line arguments
+        login   - log the clients on before they start if True
+
+    returns a dictionary with the results of the page
+    """
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    per_thread = max(args.requests // args.threads, 1)
+
+    def worker(thread):
+        client = app.test_client()
+
+        # every thread has its own random generator, so the requests don't
+        #   depend on the order in which the threads run
+        rng = random.Random(args.seed + thread)
+
+        if login:
+            client.post("/login", data={"username": f"user{thread}",
+                                        "password": PASSWORD})
+
+        # a few requests to warm up
+        for number in range(min(5, per_thread)):
+            request(client, -number - 1 - thread * per_thread, rng)
+
+        measured = []
+        failed = 0
+        for number in range(per_thread):
+            start = time.perf_counter()
+            response = request(client, thread * per_thread + number, rng)
+            measured.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                failed += 1
+
+        with lock:
+            latencies.extend(measured)
+            errors[0] += failed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(worker, range(args.threads)))
+    duration = time.perf_counter() - start
+
+    latencies.sort()
+
+    return {"page": name, "requests": len(latencies), "errors": errors[0],
+            "throughput": len(latencies) / duration,
+            "p50_ms": percentile(latencies, 0.50) * 1000,
+            "p95_ms": percentile(latencies, 0.95) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000}
+
+
+def main():
+    """
+    seeds the database, runs all pages and reports the results
+    """
+
+    # read the command line arguments
+    parser = argparse.ArgumentParser(description="benchmark the app")
+    parser.add_argument("--database-url",
+                        help="database to seed (default: a new sqlite file)")
+    parser.add_argument("--books", type=int, default=10000)
+    parser.add_argument("--accounts", type=int, default=1000)
+    parser.add_argument("--reviews-per-book", type=int, default=5)
+    parser.add_argument("--requests", type=int, default=1000,
+                        help="requests per page (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--pbkdf2-iterations", type=int, default=None,
+                        help="iterations of new hashes (default: the app "
+                        "default)")
+    parser.add_argument("--pages", default="search,book,api,login,register",
+                        help="comma separated pages to run")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="json file for the results")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    # configure the app before it is imported
+    database_url = args.database_url or \
+        "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["GOODREADS_URL"] = start_stub()
+    os.environ.setdefault("SESSION_BACKEND", "memory")
+
+    # the load comes from one ip address, so don't limit its rate
+    for name in ("LOGIN_RATE_IP", "LOGIN_RATE_USER", "API_RATE_IP"):
+        os.environ.setdefault(name, "1000000000/1")
+    if args.pbkdf2_iterations:
+        os.environ["PBKDF2_ITERATIONS"] = str(args.pbkdf2_iterations)
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import scoped_session, sessionmaker
+
+    # seed the database
+    start = time.perf_counter()
+    engine = create_engine(database_url)
+    db = scoped_session(sessionmaker(bind=engine))
+    isbns, words = seed(db, engine.dialect.name, args, rng)
+    db.remove()
+    print(f"seeded {args.books} books, {args.accounts} accounts and "
+          f"{args.reviews_per_book} reviews per book in "
+          f"{time.perf_counter() - start:.1f} s", file=sys.stderr)
+
+    import application
+    app = application.app
+
+    # the request of every page (number is unique per request, rng is the
+    #   random generator of the thread)
+    requests = {
+        "search": (lambda client, number, rng: client.get(
+            "/search", query_string={"search": rng.choice(words)}), True),
+        "book": (lambda client, number, rng: client.get(
+            f"/{rng.choice(isbns)}"), True),
+        "api": (lambda client, number, rng: client.get(
+            f"/api/{rng.choice(isbns)}"), False),
+        "login": (lambda client, number, rng: client.post(
+            "/login", data={"username": f"user{number % args.accounts}",
+                            "password": PASSWORD}), False),
+        "register": (lambda client, number, rng: client.post(
+            "/register", data={"register_username": f"bench{number}",
+                               "register_password": PASSWORD,
+                               "register_rpassword": PASSWORD}), False),
+    }
+
+    results = []
+    for name in args.pages.split(","):
+        request, login = requests[name]
+        results.append(run_scenario(app, name, request, args, login))
+
+    # print a table and write the json
+    print(f"{'page':10} {'requests':>8} {'errors':>6} {'req/s':>9} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for result in results:
+        print(f"{result['page']:10} {result['requests']:8} "
+              f"{result['errors']:6} {result['throughput']:9.1f} "
+              f"{result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+              f"{result['p99_ms']:8.2f}")
+
+    report = {"config": {key: value for key, value in vars(args).items()
+                         if key != "database_url"},
+              "database": engine.dialect.name, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+# execute the main function if the program is run
+if __name__ == "__main__":
+    main()
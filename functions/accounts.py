@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+accounts.py creates many accounts at once, for load tests or to move
+    accounts from an other system
+
+usage (from the directory of application.py):
+    python -m functions.accounts --count N [--prefix user]
+                                 [--password password]
+    python -m functions.accounts --csv accounts.csv
+
+    options:
+        --batch-size N      number of accounts per batch (default 1000)
+        --workers N         processes which hash the passwords (default: the
+                            number of cpus)
+        --same-hash         hash the password once for all accounts (only
+                            for load tests with one password)
+
+    the csv file has the columns username and password, usernames which are
+        already present are skipped, the usernames and passwords are escaped
+        like the register page does
+
+references:
+    https://docs.python.org/3/library/concurrent.futures.html
+"""
+
+# used imports
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from concurrent.futures import ProcessPoolExecutor
+from flask import escape
+from functions import security
+import argparse
+import csv
+import importlib
+import os
+import time
+
+# import.py can't be imported by name (import is a keyword), its batches()
+#   is used for the batches of accounts
+loader = importlib.import_module("functions.import")
+
+
+def read_accounts(path):
+    """
+    reads the accounts from a csv file one row at a time
+
+    parameters:
+        path - is the path of the csv file (username, password)
+
+    yields (username, password) tuples
+    """
+
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+
+        # skip the headers
+        next(reader, None)
+
+        for username, password in reader:
+            yield username, password
+
+
+def numbered_accounts(count, prefix, password):
+    """
+    gives accounts with numbered usernames (prefix0, prefix1, ...)
+
+    parameters:
+        count    - is the number of accounts
+        prefix   - is the start of the usernames
+        password - is the password of all accounts
+
+    yields (username, password) tuples
+    """
+
+    for number in range(count):
+        yield f"{prefix}{number}", password
+
+
+def provision(db, accounts, batch_size=1000, workers=None, same_hash=False):
+    """
+    hashes the passwords in a process pool and inserts the accounts batch by
+        batch, usernames which are already present are skipped
+
+    parameters:
+        db         - is the database session
+        accounts   - is an iterable of (username, password) tuples
+        batch_size - is the number of accounts per batch
+        workers    - is the number of hashing processes (None for the number
+                     of cpus)
+        same_hash  - hash only the first password and use it for all accounts
+
+    returns a tuple with the number of given and of inserted accounts
+    """
+
+    query = ("INSERT INTO accounts (username, password) "
+             "VALUES (:username, :password) "
+             "ON CONFLICT (username) DO NOTHING")
+
+    count = 0
+    inserted = 0
+    shared_hash = None
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in loader.batches(accounts, batch_size):
+
+            # escape the usernames and passwords like register() and
+            #   login() do, else they can't log on
+            batch = [(str(escape(username)), str(escape(password)))
+                     for username, password in batch]
+            passwords = [password for username, password in batch]
+
+            # hash the passwords in the processes of the pool
+            if not same_hash:
+                hashes = pool.map(security.hash_psswd, passwords,
+                                  chunksize=16)
+            else:
+                if shared_hash is None:
+                    shared_hash = security.hash_psswd(passwords[0])
+                hashes = [shared_hash] * len(batch)
+
+            # insert the batch with one executemany
+            result = db.execute(query, [
+                {"username": username, "password": psswd_hash}
+                for (username, password), psswd_hash in zip(batch, hashes)])
+            db.commit()
+
+            count += len(batch)
+            inserted += max(result.rowcount, 0)
+
+    return count, inserted
+
+
+def main():
+    """
+    creates the accounts and reports the speed
+    """
+
+    # read the command line arguments
+    parser = argparse.ArgumentParser(description="create many accounts")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", help="csv file with the accounts "
+                        "(username, password)")
+    source.add_argument("--count", type=int,
+                        help="number of numbered accounts")
+    parser.add_argument("--prefix", default="user",
+                        help="start of the numbered usernames (default: "
+                        "%(default)s)")
+    parser.add_argument("--password", default="password",
+                        help="password of the numbered accounts (default: "
+                        "%(default)s)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="number of accounts per batch (default: "
+                        "%(default)s)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="hashing processes (default: number of cpus)")
+    parser.add_argument("--same-hash", action="store_true",
+                        help="hash the password once for all accounts")
+    args = parser.parse_args()
+
+    # set up database
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    db = scoped_session(sessionmaker(bind=engine))
+
+    if args.csv:
+        accounts = read_accounts(args.csv)
+    else:
+        accounts = numbered_accounts(args.count, args.prefix, args.password)
+
+    start = time.perf_counter()
+    count, inserted = provision(db, accounts, args.batch_size, args.workers,
+                                args.same_hash)
+
+    duration = time.perf_counter() - start
+    print(f"created {inserted} of {count} accounts in {duration:.2f} s "
+          f"({count / max(duration, 1e-9):.0f} accounts/s)")
+
+
+# execute the main function if the program is run
+if __name__ == "__main__":
+    main()
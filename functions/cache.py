@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+cache.py defines a thread-safe LRU cache where every item has a time to live
+    and a store with the same api which keeps the items in redis
+"""
+
+# used imports
+import json
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+# returned by get when a key is not in the cache (None can be a cached value)
+MISSING = object()
+
+
+class TTLCache:
+    """
+    least recently used cache with a maximum size where every item expires
+        after its time to live, it can be saved to and loaded from a json
+        file so it survives a restart
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, path=None):
+        """
+        parameters:
+            maxsize - is the maximum number of items in the cache
+            ttl     - is the default time to live of an item in seconds
+            path    - is the json file to save the cache to (None for none)
+        """
+
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+
+        # key -> (expire time, value), the last item was used most recently
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+        # load the saved cache if there is one
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self.get(key) is not MISSING
+
+    def get(self, key, default=MISSING):
+        """
+        gives the value of a key if it is in the cache and not expired
+
+        parameters:
+            key     - is the key of the item
+            default - is returned if the key isn't in the cache
+
+        returns the cached value or the default
+        """
+
+        with self._lock:
+            item = self._items.get(key)
+
+            # not in the cache
+            if item is None:
+                return default
+
+            # remove the item if it is expired
+            expires, value = item
+            if expires < time.time():
+                del self._items[key]
+                return default
+
+            # mark as most recently used
+            self._items.move_to_end(key)
+
+            return value
+
+    def set(self, key, value, ttl=None):
+        """
+        adds/replaces an item in the cache, the least recently used item is
+            removed if the cache is full
+
+        parameters:
+            key   - is the key of the item
+            value - is the value of the item
+            ttl   - is the time to live in seconds (None for the default)
+        """
+
+        # the expire time of the item
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+
+        with self._lock:
+            self._items[key] = (expires, value)
+            self._items.move_to_end(key)
+
+            # remove the least recently used items
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        """
+        removes an item from the cache
+
+        parameters:
+            key - is the key of the item
+        """
+
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """
+        removes all items from the cache
+        """
+
+        with self._lock:
+            self._items.clear()
+
+    def save(self):
+        """
+        saves the items which aren't expired to the json file
+        """
+
+        if not self.path:
+            return
+
+        now = time.time()
+        with self._lock:
+            items = [[key, expires, value]
+                     for key, (expires, value) in self._items.items()
+                     if expires >= now]
+
+        # write to a temporary file first so a crash can't break the cache
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(items, f)
+        os.replace(tmp_path, self.path)
+
+    def load(self):
+        """
+        loads the items which aren't expired from the json file
+        """
+
+        # ignore a missing or broken cache file
+        try:
+            with open(self.path) as f:
+                items = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        now = time.time()
+        with self._lock:
+            for key, expires, value in items[-self.maxsize:]:
+                if expires >= now:
+                    self._items[key] = (expires, value)
+
+
+class RedisStore:
+    """
+    stores json items in redis (or a client with the same api) with the
+        same get/set/delete api as TTLCache, so it can be shared between
+        workers
+    """
+
+    def __init__(self, client, ttl=3600):
+        """
+        parameters:
+            client - is the redis client (e.g. redis.Redis or a fake one)
+            ttl    - is the default time to live of an item in seconds
+        """
+
+        self.client = client
+        self.ttl = ttl
+
+    def get(self, key, default=MISSING):
+        data = self.client.get(key)
+        return default if data is None else json.loads(data)
+
+    def set(self, key, value, ttl=None):
+        self.client.setex(key, int(self.ttl if ttl is None else ttl),
+                          json.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+
+def redis_client():
+    """
+    connects to redis at REDIS_URL (redis is only needed when this is used)
+
+    returns the redis client
+    """
+
+    import redis
+
+    return redis.Redis.from_url(os.getenv("REDIS_URL",
+                                          "redis://localhost:6379/0"))
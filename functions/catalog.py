@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+catalog.py keeps a read-only copy of the books table (with the stored
+    goodreads ratings) in memory, so a book can be found by isbn without
+    asking the database
+
+usage (from the directory of application.py):
+    python -m functions.catalog     load the catalog of DATABASE_URL and print
+                                    its memory use per 100k books
+
+references:
+    https://docs.python.org/3/reference/datamodel.html#slots
+    https://docs.python.org/3/library/sys.html#sys.intern
+"""
+
+# used imports
+import os
+import sys
+import threading
+import time
+
+
+class BookRecord:
+    """
+    one book of the catalog, it has the same attributes as a row of the
+        book query of the book page (so the templates can use both)
+    """
+
+    __slots__ = ("id", "title", "author", "year", "isbn", "review_count",
+                 "rating_sum", "average_score", "gr_average", "gr_count",
+                 "gr_fetched")
+
+    def __init__(self, row):
+        self.id = row.id
+        self.year = row.year
+        self.review_count = row.review_count or 0
+        self.rating_sum = float(row.rating_sum or 0)
+        self.gr_average = row.gr_average
+        self.gr_count = row.gr_count
+        self.gr_fetched = row.gr_fetched
+
+        # many books share an author, so the strings are interned
+        self.title = sys.intern(row.title)
+        self.author = sys.intern(row.author)
+        self.isbn = sys.intern(row.isbn)
+
+        # the average score is None for books without reviews
+        self.average_score = float(row.average_score) \
+            if row.average_score is not None else None
+
+
+class Catalog:
+    """
+    the books by isbn and by id, the whole catalog is replaced when it is
+        loaded again and a new review updates the book in place
+    """
+
+    def __init__(self):
+
+        # lock for replacing the catalog or changing a book
+        self._lock = threading.Lock()
+
+        # isbn -> BookRecord and id -> BookRecord
+        self._by_isbn = dict()
+        self._by_id = dict()
+
+        # the time the catalog was loaded (0 if never)
+        self.loaded = 0
+
+    def __len__(self):
+        return len(self._by_isbn)
+
+    def load(self, db):
+        """
+        (re)loads all books with their stored goodreads ratings
+
+        parameters:
+            db - is the database session
+        """
+
+        rows = db.execute("SELECT books.id, books.title, books.author, "
+                          "books.year, books.isbn, books.review_count, "
+                          "books.rating_sum, books.average_score, "
+                          "ratings.average_rating AS gr_average, "
+                          "ratings.ratings_count AS gr_count, "
+                          "ratings.fetched_at AS gr_fetched FROM books "
+                          "LEFT JOIN ratings ON ratings.isbn=books.isbn")
+
+        by_isbn = dict()
+        by_id = dict()
+        for row in rows:
+            record = BookRecord(row)
+            by_isbn[record.isbn] = record
+            by_id[record.id] = record
+
+        # replace the catalog at once
+        with self._lock:
+            self._by_isbn = by_isbn
+            self._by_id = by_id
+            self.loaded = time.monotonic()
+
+    def get(self, isbn):
+        """
+        gives the book with an isbn or None if it isn't in the catalog
+        """
+
+        return self._by_isbn.get(isbn)
+
+    def get_ids(self, book_ids):
+        """
+        gives the books with the ids which are in the catalog
+
+        parameters:
+            book_ids - is a list of book ids
+
+        returns a dictionary with id -> BookRecord
+        """
+
+        by_id = self._by_id
+
+        return {book_id: by_id[book_id] for book_id in book_ids
+                if book_id in by_id}
+
+    def add_review(self, isbn, rating):
+        """
+        updates the review count, rating sum and average score of a book
+            the same way as the review query of the book page
+
+        parameters:
+            isbn   - is the isbn of the reviewed book
+            rating - is the rating of the review
+        """
+
+        with self._lock:
+            record = self._by_isbn.get(isbn)
+            if record is not None:
+                record.review_count += 1
+                record.rating_sum += rating
+                record.average_score = record.rating_sum / record.review_count
+
+    def memory_usage(self):
+        """
+        estimates the memory used by the catalog (the records, their strings
+            and numbers and the two dictionaries), shared objects are
+            counted once
+
+        returns the number of bytes
+        """
+
+        seen = set()
+        size = sys.getsizeof(self._by_isbn) + sys.getsizeof(self._by_id)
+
+        for record in self._by_isbn.values():
+            size += sys.getsizeof(record)
+            for name in BookRecord.__slots__:
+                value = getattr(record, name)
+                if value is not None and id(value) not in seen:
+                    seen.add(id(value))
+                    size += sys.getsizeof(value)
+
+        return size
+
+
+def main():
+    """
+    loads the catalog and prints its memory use
+    """
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import scoped_session, sessionmaker
+
+    # Check for environment variable
+    if not os.getenv("DATABASE_URL"):
+        raise RuntimeError("DATABASE_URL is not set")
+
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    db = scoped_session(sessionmaker(bind=engine))
+
+    catalog = Catalog()
+    start = time.perf_counter()
+    catalog.load(db)
+    seconds = time.perf_counter() - start
+
+    size = catalog.memory_usage()
+    print(f"loaded {len(catalog)} books in {seconds:.2f} s, "
+          f"{size / 2 ** 20:.1f} MiB")
+    if len(catalog):
+        print(f"{size / len(catalog) * 100000 / 2 ** 20:.1f} MiB "
+              f"per 100k books")
+
+
+# execute the main function if the program is run
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+dbpool.py creates the database engine with a connection pool which is
+    configured by the environment and keeps track of its use
+
+environment:
+    DB_POOL_SIZE        - number of kept connections (default 5)
+    DB_MAX_OVERFLOW     - number of extra connections (default 10)
+    DB_POOL_TIMEOUT     - seconds to wait for a connection (default 30)
+    DB_POOL_RECYCLE     - seconds after which a connection is replaced
+                          (default 1800, -1 for never)
+    DB_POOL_PRE_PING    - check a connection before it is used (default 1)
+
+references:
+    https://docs.sqlalchemy.org/en/13/core/pooling.html
+"""
+
+# used imports
+import os
+import threading
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError
+from functions import metrics
+
+
+class TimedQueuePool(QueuePool):
+    """
+    queue pool which measures how long it takes to get a connection
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # the number of checkouts, the time waited and the timeouts
+        self.stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            with self.stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - start
+            with self.stats_lock:
+                self.checkouts += 1
+                self.wait_total += wait
+                self.wait_max = max(self.wait_max, wait)
+
+
+def create_pooled_engine(url):
+    """
+    creates the database engine, with the pool settings of the environment
+        (sqlite keeps the default pool of sqlalchemy)
+
+    parameters:
+        url - is the database url
+
+    returns the engine
+    """
+
+    if make_url(url).get_backend_name() == "sqlite":
+        return create_engine(url)
+
+    return create_engine(
+        url, poolclass=TimedQueuePool,
+        pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", 1800)),
+        pool_pre_ping=os.getenv("DB_POOL_PRE_PING", "1") == "1")
+
+
+def instrument(engine):
+    """
+    measures the time of every query of the engine (see metrics.py)
+
+    parameters:
+        engine - is the database engine
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_query(conn, cursor, statement, parameters, context,
+                     executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_query(conn, cursor, statement, parameters, context,
+                    executemany):
+        seconds = time.perf_counter() - conn.info["query_start"].pop()
+        metrics.observe("db_query_seconds", seconds)
+        metrics.add_timing("db", seconds)
+
+
+def pool_status(engine):
+    """
+    gives the state of the connection pool of the engine
+
+    parameters:
+        engine - is the database engine
+
+    returns a dictionary with the pool size, checked out/in connections,
+        overflow and the time waited for connections
+    """
+
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+
+    # only the queue pools have a size
+    if isinstance(pool, QueuePool):
+        status.update(size=pool.size(), checked_out=pool.checkedout(),
+                      checked_in=pool.checkedin(), overflow=pool.overflow())
+
+    # the measurements of the timed pool
+    if isinstance(pool, TimedQueuePool):
+        with pool.stats_lock:
+            status.update(checkouts=pool.checkouts,
+                          wait_total=round(pool.wait_total, 6),
+                          wait_max=round(pool.wait_max, 6),
+                          timeouts=pool.timeouts)
+
+    return status
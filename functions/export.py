@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+export.py exports the books (with their review count and average score) as
+    ndjson or csv, the rows are read with a server-side cursor so the memory
+    use doesn't depend on the size of the books table
+
+usage:
+    python export.py [--format ndjson|csv] [--gzip] [--output FILE]
+
+references:
+    https://docs.sqlalchemy.org/en/13/core/connections.html#sqlalchemy.engine.Connection.execution_options
+    https://flask.palletsprojects.com/en/1.1.x/patterns/streaming/
+"""
+
+# used imports
+from sqlalchemy import create_engine
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import zlib
+
+# the exported columns in the order of the export
+COLUMNS = ("isbn", "title", "author", "year", "review_count", "average_score")
+
+
+def export_rows(engine, batch_size=1000):
+    """
+    reads all books with a server-side cursor
+
+    parameters:
+        engine     - is the database engine
+        batch_size - is the number of rows fetched at once
+
+    yields the rows of the books ordered by id
+    """
+
+    # a separate connection which streams the result instead of buffering it
+    connection = engine.connect().execution_options(stream_results=True)
+
+    try:
+        result = connection.execute("SELECT isbn, title, author, year, "
+                                    "review_count, average_score "
+                                    "FROM books ORDER BY id")
+
+        # fetch the rows in batches
+        rows = result.fetchmany(batch_size)
+        while rows:
+            yield from rows
+            rows = result.fetchmany(batch_size)
+    finally:
+        connection.close()
+
+
+def row_values(row):
+    """
+    gives the exported values of a row (the average score as a float)
+
+    parameters:
+        row - is the row of a book
+
+    returns a list with the values in the order of COLUMNS
+    """
+
+    values = [row[column] for column in COLUMNS]
+    if values[-1] is not None:
+        values[-1] = round(float(values[-1]), 2)
+
+    return values
+
+
+def ndjson_lines(rows):
+    """
+    converts rows to ndjson (one json object per line)
+
+    parameters:
+        rows - is an iterable of rows
+
+    yields the lines
+    """
+
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row_values(row))),
+                         separators=(",", ":")) + "\n"
+
+
+def csv_lines(rows):
+    """
+    converts rows to csv lines with a header
+
+    parameters:
+        rows - is an iterable of rows
+
+    yields the lines
+    """
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    # the header and then a line per row
+    writer.writerow(COLUMNS)
+    for row in rows:
+        writer.writerow(row_values(row))
+
+        # give what is written and empty the buffer
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # the header if there were no rows
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def gzip_chunks(lines, chunk_size=64 * 1024):
+    """
+    compresses lines to a gzip stream
+
+    parameters:
+        lines      - is an iterable of text lines
+        chunk_size - is the number of bytes collected before compressing
+
+    yields the compressed chunks (bytes)
+    """
+
+    # wbits 31 gives the gzip format
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    pending = []
+    size = 0
+
+    for line in lines:
+        data = line.encode("utf-8")
+        pending.append(data)
+        size += len(data)
+
+        # compress once enough is collected
+        if size >= chunk_size:
+            chunk = compressor.compress(b"".join(pending))
+            pending, size = [], 0
+            if chunk:
+                yield chunk
+
+    yield compressor.compress(b"".join(pending)) + compressor.flush()
+
+
+def export(engine, form="ndjson", compress=False, batch_size=1000):
+    """
+    exports all books
+
+    parameters:
+        engine     - is the database engine
+        form       - is the format (ndjson or csv)
+        compress   - compress with gzip if True
+        batch_size - is the number of rows fetched at once
+
+    yields the exported text (or bytes if compressed)
+    """
+
+    rows = export_rows(engine, batch_size)
+
+    if form == "csv":
+        lines = csv_lines(rows)
+    else:
+        lines = ndjson_lines(rows)
+
+    return gzip_chunks(lines) if compress else lines
+
+
+def main():
+    """
+    exports the books to a file or stdout
+    """
+
+    # read the command line arguments
+    parser = argparse.ArgumentParser(description="export the books")
+    parser.add_argument("--format", default="ndjson",
+                        choices=["ndjson", "csv"])
+    parser.add_argument("--gzip", action="store_true",
+                        help="compress the export with gzip")
+    parser.add_argument("--output", help="file to write to (default: stdout)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="number of rows fetched at once (default: "
+                        "%(default)s)")
+    args = parser.parse_args()
+
+    # set up database
+    engine = create_engine(os.getenv("DATABASE_URL"))
+
+    # write to the file or stdout (bytes if compressed)
+    mode = "wb" if args.gzip else "w"
+    if args.output:
+        f = open(args.output, mode)
+    else:
+        f = sys.stdout.buffer if args.gzip else sys.stdout
+
+    for chunk in export(engine, args.format, args.gzip, args.batch_size):
+        f.write(chunk)
+
+    if args.output:
+        f.close()
+
+
+# execute the main function if the program is run
+if __name__ == "__main__":
+    main()
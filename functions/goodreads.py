@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+goodreads.py gets the average rating and rating count of books from the
+    goodreads api (or any server with the same api, like a local stub)
+
+references:
+    https://requests.readthedocs.io/en/latest/user/advanced/#session-objects
+"""
+
+# used imports
+import atexit
+import os
+import requests
+import time
+
+from requests.adapters import HTTPAdapter
+from functions.cache import TTLCache, MISSING
+from functions import metrics
+
+# url and key of the api, GOODREADS_URL can point to a local stub server
+GOODREADS_URL = os.getenv("GOODREADS_URL",
+                          "https://www.goodreads.com/book/review_counts.json")
+GOODREADS_KEY = os.getenv("GOODREADS_KEY", "4cWZI3ifMz0RSj1NFaYiBQ")
+
+
+class RatingsProvider:
+    """
+    gets ratings from the goodreads api with a pooled http session and
+        caches them by isbn, books without a rating (or failed requests)
+        are cached for a shorter time
+    """
+
+    def __init__(self, url=GOODREADS_URL, key=GOODREADS_KEY, timeout=(1, 2),
+                 ttl=24 * 3600, miss_ttl=600, maxsize=10000, path=None,
+                 session=None):
+        """
+        parameters:
+            url      - is the url of the review_counts api
+            key      - is the api key
+            timeout  - is the (connect, read) timeout of a request in seconds
+            ttl      - is the time a found rating is cached in seconds
+            miss_ttl - is the time a missing rating is cached in seconds
+            maxsize  - is the maximum number of cached ratings
+            path     - is the json file to save the cache to (None for none)
+            session  - is the http session to use (a new one if None)
+        """
+
+        self.url = url
+        self.key = key
+        self.timeout = timeout
+        self.miss_ttl = miss_ttl
+        self.cache = TTLCache(maxsize, ttl, path)
+
+        # reuse the connections to the api
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
+
+        # save the cache when the program stops
+        if path:
+            atexit.register(self.cache.save)
+
+    def fetch(self, isbns, raise_errors=False):
+        """
+        gets the ratings of one or more books from the api in one request
+
+        parameters:
+            isbns        - is a list of isbns
+            raise_errors - raise a failed request instead of giving no
+                           ratings
+
+        returns a dictionary with isbn -> [avg rating, rating count] or None
+            if the book has no rating
+        """
+
+        ratings = dict.fromkeys(isbns)
+
+        # ask the api, a failed request means no ratings
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.url, timeout=self.timeout,
+                                        params={"key": self.key,
+                                                "isbns": ",".join(isbns)})
+        except requests.RequestException:
+            if raise_errors:
+                raise
+            return ratings
+
+        # measure the time of the request
+        finally:
+            seconds = time.perf_counter() - start
+            metrics.observe("goodreads_seconds", seconds)
+            metrics.add_timing("ext", seconds)
+
+        # the api gives 404 if none of the books is found
+        if response.status_code != 200:
+            if raise_errors and response.status_code != 404:
+                response.raise_for_status()
+            return ratings
+
+        try:
+            books = response.json()["books"]
+        except (ValueError, KeyError, TypeError):
+            return ratings
+
+        # get the average_rating and ratings_count of the found books
+        for book in books:
+            gr_ar = book.get("average_rating")
+            gr_nor = book.get("ratings_count")
+
+            # find under which of the requested isbns the book was found
+            isbn = next((number for number in (book.get("isbn"),
+                                               book.get("isbn13"))
+                         if number in ratings), None)
+
+            # if the rating or count is 0 the book gets the value None
+            if isbn is not None and gr_ar not in (None, "0.0") and gr_nor:
+                ratings[isbn] = [gr_ar, gr_nor]
+
+        return ratings
+
+    def rating(self, isbn):
+        """
+        gives the (cached) rating of a book
+
+        parameters:
+            isbn - is the isbn of the book
+
+        returns a list with the avg rating and rating count or None
+        """
+
+        # use the cached rating if there is one (None is a cached miss)
+        goodreads = self.cache.get(isbn)
+        if goodreads is not MISSING:
+            return goodreads
+
+        goodreads = self.fetch([isbn])[isbn]
+
+        # cache misses shorter so a rating can still show up later
+        self.cache.set(isbn, goodreads,
+                       None if goodreads else self.miss_ttl)
+
+        return goodreads
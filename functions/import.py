@@ -2,60 +2,411 @@
 # -*- coding: utf-8 -*-
 """
 version: python 3+
-import.py imports all books from books.csv and creates the database
+import.py creates/migrates the database and imports all books from books.csv
 Dani van Enk, 11823526
 
+usage:
+    python import.py            migrate the database and import books.csv
+    python import.py migrate    only migrate the database
+    python import.py load       only import books.csv
+    python import.py reconcile  recompute the review count/average of all
+                                books from the reviews
+
+    options for importing:
+        --csv PATH          import an other csv file
+        --batch-size N      number of books per batch (default 1000)
+        --upsert            update the books which are already present
+        --copy              use COPY FROM STDIN (postgresql only)
+
 references:
     https://cs50.harvard.edu/web/notes/3/
+    https://www.postgresql.org/docs/current/pgtrgm.html
 """
 
 # used imports
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
+import argparse
+import io
 import os
 import csv
+import time
 
 
-def main():
+def create_tables(db, dialect):
     """
-    import the books.csv and create the accounts, books and review tables
+    creates the accounts, books and reviews tables
+
+    parameters:
+        db      - is the database session
+        dialect - is the name of the database dialect (postgresql/sqlite)
     """
 
-    # set up database
-    engine = create_engine(os.getenv("DATABASE_URL"))
-    db = scoped_session(sessionmaker(bind=engine))
+    # sqlite has no SERIAL type
+    if dialect == "sqlite":
+        serial = "INTEGER PRIMARY KEY AUTOINCREMENT"
+    else:
+        serial = "SERIAL PRIMARY KEY"
 
     # create accounts/books/reviews tables
-    db.execute("CREATE TABLE accounts (id SERIAL PRIMARY KEY, "
+    db.execute(f"CREATE TABLE IF NOT EXISTS accounts (id {serial}, "
                "username VARCHAR NOT NULL, password VARCHAR NOT NULL);")
-    db.execute("CREATE TABLE books (id SERIAL PRIMARY KEY, "
+    db.execute(f"CREATE TABLE IF NOT EXISTS books (id {serial}, "
                "title VARCHAR NOT NULL, author VARCHAR NOT NULL, "
                "year INTEGER NOT NULL, isbn VARCHAR NOT NULL, "
                "review_count INTEGER, average_score DECIMAL);")
-    db.execute("CREATE TABLE reviews (id SERIAL PRIMARY KEY, "
+    db.execute(f"CREATE TABLE IF NOT EXISTS reviews (id {serial}, "
                "user_id INTEGER REFERENCES accounts NOT NULL, rating DECIMAL, "
                "text VARCHAR NOT NULL, "
                "book_id INTEGER REFERENCES books NOT NULL);")
 
+
+def create_indexes(db, dialect):
+    """
+    creates the indexes for the isbn/username lookups, the reviews of a book
+        and the ILIKE search (pg_trgm, only for postgresql)
+
+    parameters:
+        db      - is the database session
+        dialect - is the name of the database dialect (postgresql/sqlite)
+    """
+
+    # indexes for the lookups by isbn/username and the reviews of a book
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS books_isbn_key "
+               "ON books (isbn);")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS accounts_username_key "
+               "ON accounts (username);")
+    db.execute("CREATE INDEX IF NOT EXISTS reviews_book_id_user_id_idx "
+               "ON reviews (book_id, user_id);")
+
+    # trigram indexes so ILIKE '%word%' doesn't need a sequential scan
+    if dialect == "postgresql":
+        db.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+        for column in ("title", "author", "isbn"):
+            db.execute(f"CREATE INDEX IF NOT EXISTS books_{column}_trgm_idx "
+                       f"ON books USING gin ({column} gin_trgm_ops);")
+
+
+def add_rating_sum(db, dialect):
+    """
+    adds the running sum of the ratings to the books table and fills it
+
+    parameters:
+        db      - is the database session
+        dialect - is the name of the database dialect (postgresql/sqlite)
+    """
+
+    db.execute("ALTER TABLE books ADD COLUMN rating_sum DECIMAL "
+               "NOT NULL DEFAULT 0;")
+    reconcile(db)
+
+
+def create_ratings(db, dialect):
+    """
+    creates the ratings table with the goodreads ratings of the books
+
+    parameters:
+        db      - is the database session
+        dialect - is the name of the database dialect (postgresql/sqlite)
+    """
+
+    db.execute("CREATE TABLE IF NOT EXISTS ratings (isbn VARCHAR PRIMARY KEY, "
+               "average_rating DECIMAL, ratings_count INTEGER, "
+               "fetched_at FLOAT NOT NULL);")
+
+
+def add_review_unique(db, dialect):
+    """
+    removes the second (and later) reviews of a user for the same book and
+        adds a unique index on reviews (user_id, book_id), so a review can
+        be added with ON CONFLICT DO NOTHING instead of checking first
+
+    parameters:
+        db      - is the database session
+        dialect - is the name of the database dialect (postgresql/sqlite)
+    """
+
+    db.execute("DELETE FROM reviews WHERE id NOT IN (SELECT MIN(id) "
+               "FROM reviews GROUP BY user_id, book_id);")
+    db.execute("CREATE UNIQUE INDEX IF NOT EXISTS reviews_user_id_book_id_key "
+               "ON reviews (user_id, book_id);")
+    reconcile(db)
+
+
+# all migrations (version, description, function) in the order to apply them
+MIGRATIONS = [
+    (1, "create accounts/books/reviews tables", create_tables),
+    (2, "add lookup and trigram indexes", create_indexes),
+    (3, "add running rating sum to books", add_rating_sum),
+    (4, "create goodreads ratings table", create_ratings),
+    (5, "add unique index on the reviews per user and book",
+     add_review_unique),
+]
+
+
+def schema_version(db):
+    """
+    gives the current version of the database schema
+
+    parameters:
+        db - is the database session
+
+    returns the version of the last applied migration (0 if none)
+    """
+
+    # make sure the version table exists
+    db.execute("CREATE TABLE IF NOT EXISTS schema_version "
+               "(version INTEGER NOT NULL);")
+
+    version = db.execute("SELECT MAX(version) FROM schema_version").scalar()
+
+    return version or 0
+
+
+def migrate(db, dialect):
+    """
+    applies all migrations which haven't been applied yet, each migration
+        is committed separately
+
+    parameters:
+        db      - is the database session
+        dialect - is the name of the database dialect (postgresql/sqlite)
+
+    returns the version of the database schema after the migration
+    """
+
+    # get the version of the database
+    version = schema_version(db)
+
+    # apply and register every newer migration
+    for number, description, migration in MIGRATIONS:
+        if number > version:
+            print(f"migration {number}: {description}")
+            migration(db, dialect)
+            db.execute("INSERT INTO schema_version (version) "
+                       "VALUES (:version)", {"version": number})
+            db.commit()
+            version = number
+
+    return version
+
+
+def reconcile(db):
+    """
+    recomputes the review count, rating sum and average score of all books
+        from the reviews table in one query
+
+    parameters:
+        db - is the database session
+    """
+
+    db.execute("UPDATE books SET (review_count, rating_sum, average_score)="
+               "(SELECT COUNT(*), COALESCE(SUM(rating), 0), AVG(rating) "
+               "FROM reviews WHERE reviews.book_id=books.id);")
+
+
+def read_books(path):
+    """
+    reads the books from a csv file one row at a time
+
+    parameters:
+        path - is the path of the csv file (isbn, title, author, year)
+
+    yields a dictionary per book
+    """
+
     # open books.csv and make a csv read object
-    f = open("../books.csv")
-    reader = csv.reader(f)
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+
+        # skip the headers
+        next(reader, None)
+
+        for isbn, title, author, year in reader:
+            yield {"title": title, "author": author, "year": int(year),
+                   "isbn": isbn}
+
+
+def batches(rows, size):
+    """
+    groups rows in lists of a maximum size
+
+    parameters:
+        rows - is an iterable of rows
+        size - is the maximum number of rows in a batch
+
+    yields lists of rows
+    """
+
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+
+    # the last (smaller) batch
+    if batch:
+        yield batch
+
+
+def insert_query(table, upsert):
+    """
+    gives the query to insert books with the isbn as conflict target
+
+    parameters:
+        table  - is the table (or query) the values come from, or None to
+                 insert bound values
+        upsert - update the existing books if True, else skip them
+
+    returns the query string
+    """
+
+    # insert bound values or the rows of an other table
+    if table is None:
+        source = "VALUES (:title, :author, :year, :isbn)"
+    else:
+        source = f"SELECT title, author, year, isbn FROM {table}"
+
+    # update or skip the books with an isbn which is already present
+    if upsert:
+        conflict = ("DO UPDATE SET title=excluded.title, "
+                    "author=excluded.author, year=excluded.year")
+    else:
+        conflict = "DO NOTHING"
+
+    # "WHERE true" is needed by sqlite to parse ON CONFLICT after a SELECT
+    where = "" if table is None else " WHERE true"
+
+    return (f"INSERT INTO books (title, author, year, isbn) {source}{where} "
+            f"ON CONFLICT (isbn) {conflict}")
+
+
+def load_books(db, path, batch_size=1000, upsert=False):
+    """
+    imports the books from a csv file with one executemany per batch
+
+    parameters:
+        db         - is the database session
+        path       - is the path of the csv file (isbn, title, author, year)
+        batch_size - is the number of books per batch
+        upsert     - update the books which are already present if True
+
+    returns the number of imported rows
+    """
 
-    # skip the headers
-    next(reader, None)
+    query = insert_query(None, upsert)
+    count = 0
 
-    # for each row in books.csv add the data in the database
-    for isbn, title, author, year in reader:
-        db.execute("INSERT INTO books (title, author, year, isbn) "
-                   "VALUES (:title, :author, :year, :isbn)",
-                   {"title": title, "author": author, "year": year,
-                    "isbn": isbn})
+    # insert the books batch by batch
+    for batch in batches(read_books(path), batch_size):
+        db.execute(query, batch)
+        count += len(batch)
 
     # commit the database
     db.commit()
 
-    # close the books.csv
-    f.close()
+    return count
+
+
+def copy_books(db, path, batch_size=10000, upsert=False):
+    """
+    imports the books from a csv file with COPY FROM STDIN (postgresql only)
+        into a temporary table, which is then merged with the books table
+
+    parameters:
+        db         - is the database session
+        path       - is the path of the csv file (isbn, title, author, year)
+        batch_size - is the number of books per COPY
+        upsert     - update the books which are already present if True
+
+    returns the number of imported rows
+    """
+
+    # use the psycopg2 cursor of the connection of the session
+    cursor = db.connection().connection.cursor()
+    cursor.execute("CREATE TEMPORARY TABLE books_import (line SERIAL, "
+                   "title VARCHAR, author VARCHAR, year INTEGER, "
+                   "isbn VARCHAR) ON COMMIT DROP")
+
+    count = 0
+
+    # copy the books batch by batch
+    for batch in batches(read_books(path), batch_size):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for book in batch:
+            writer.writerow([book["title"], book["author"], book["year"],
+                             book["isbn"]])
+        buffer.seek(0)
+
+        cursor.copy_expert("COPY books_import (title, author, year, isbn) "
+                           "FROM STDIN WITH CSV", buffer)
+        count += len(batch)
+
+    # merge the copied books with the books table, an isbn can only be
+    #   inserted/updated once per query so the last line of an isbn is used
+    #   (like the executemany of load_books)
+    cursor.execute(insert_query("(SELECT DISTINCT ON (isbn) * "
+                                "FROM books_import "
+                                "ORDER BY isbn, line DESC) AS books_import",
+                                upsert))
+
+    # commit the database
+    db.commit()
+
+    return count
+
+
+def main():
+    """
+    migrate the database and/or import the books.csv
+    """
+
+    # read the command line arguments
+    parser = argparse.ArgumentParser(description="create/migrate the "
+                                     "database and import the books")
+    parser.add_argument("command", nargs="?", default="all",
+                        choices=["all", "migrate", "load", "reconcile"])
+    parser.add_argument("--csv", default="../books.csv",
+                        help="csv file with the books (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=1000,
+                        help="number of books per batch (default: "
+                        "%(default)s)")
+    parser.add_argument("--upsert", action="store_true",
+                        help="update the books which are already present")
+    parser.add_argument("--copy", action="store_true",
+                        help="use COPY FROM STDIN (postgresql only)")
+    args = parser.parse_args()
+
+    # set up database
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    db = scoped_session(sessionmaker(bind=engine))
+    dialect = engine.dialect.name
+
+    # create/update the tables and indexes
+    if args.command in ("all", "migrate"):
+        version = migrate(db, dialect)
+        print(f"database schema at version {version}")
+
+    # import the books and report the speed
+    if args.command in ("all", "load"):
+        start = time.perf_counter()
+
+        if args.copy and dialect == "postgresql":
+            count = copy_books(db, args.csv, args.batch_size, args.upsert)
+        else:
+            count = load_books(db, args.csv, args.batch_size, args.upsert)
+
+        duration = time.perf_counter() - start
+        print(f"imported {count} books in {duration:.2f} s "
+              f"({count / max(duration, 1e-9):.0f} rows/s)")
+
+    # recompute the review aggregates of the books
+    if args.command == "reconcile":
+        reconcile(db)
+        db.commit()
+        print("recomputed the review count/average of all books")
 
 
 # execute the main function if the program is run
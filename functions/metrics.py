@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+metrics.py keeps latency histograms and counters of the app and gives them
+    in the prometheus text format, it also keeps the database and external
+    time of the current request (for the Server-Timing header)
+
+references:
+    https://prometheus.io/docs/instrumenting/exposition_formats/
+    https://www.w3.org/TR/server-timing/
+"""
+
+# used imports
+import bisect
+import threading
+
+# the upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10)
+
+# the upper bounds of the histogram buckets of counts (e.g. queries)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# the help text of the known metrics
+HELP = {
+    "request_seconds": "time to handle a request by endpoint",
+    "db_queries_per_request": "number of database queries per request",
+    "db_seconds_per_request": "database time per request",
+    "db_query_seconds": "time of a single database query",
+    "goodreads_seconds": "time of a request to the goodreads api",
+    "goodreads_timeouts_total": "number of book pages shown without waiting "
+                                "for goodreads",
+    "goodreads_skipped_total": "number of book pages which didn't ask "
+                               "goodreads (too many pending requests)",
+    "pbkdf2_seconds": "time to hash or compare a password (with waiting)",
+    "hashing_busy_total": "number of rejected hashes (queue full)",
+    "rate_limited_total": "number of requests rejected by a rate limit",
+    "review_batch_seconds": "time to write a batch of queued reviews",
+    "review_batch_size": "number of reviews in a written batch",
+    "review_write_errors_total": "number of queued reviews which failed",
+}
+
+
+class Histogram:
+    """
+    counts observations in buckets and keeps their sum
+    """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+# name -> labels -> Histogram / counter value
+histograms = dict()
+counters = dict()
+lock = threading.Lock()
+
+# the database/external time of the request of this thread
+current = threading.local()
+
+
+def observe(name, value, buckets=BUCKETS, **labels):
+    """
+    adds an observation to a histogram
+
+    parameters:
+        name    - is the name of the histogram
+        value   - is the observed value (seconds or a count)
+        buckets - are the upper bounds of the buckets (BUCKETS for seconds,
+                  COUNT_BUCKETS for counts), used when the histogram is made
+        labels  - are the labels of the histogram (e.g. endpoint="book")
+    """
+
+    key = tuple(sorted(labels.items()))
+
+    with lock:
+        histogram = histograms.setdefault(name, dict()).get(key)
+        if histogram is None:
+            histogram = histograms[name][key] = Histogram(buckets)
+        histogram.observe(value)
+
+
+def inc(name, amount=1, **labels):
+    """
+    increments a counter
+
+    parameters:
+        name   - is the name of the counter
+        amount - is the amount to add
+        labels - are the labels of the counter
+    """
+
+    key = tuple(sorted(labels.items()))
+
+    with lock:
+        values = counters.setdefault(name, dict())
+        values[key] = values.get(key, 0) + amount
+
+
+def start_request():
+    """
+    starts the timings of a new request in this thread
+    """
+
+    current.timings = {"db": 0.0, "db_count": 0, "ext": 0.0, "kdf": 0.0}
+
+
+def add_timing(kind, seconds):
+    """
+    adds time to the timings of the current request (if there is one)
+
+    parameters:
+        kind    - is the kind of time (db, ext or kdf)
+        seconds - is the time to add
+    """
+
+    timings = getattr(current, "timings", None)
+    if timings is not None:
+        timings[kind] += seconds
+        if kind == "db":
+            timings["db_count"] += 1
+
+
+def end_request():
+    """
+    ends the timings of the request in this thread
+
+    returns the timings of the request or None if none were started
+    """
+
+    timings = getattr(current, "timings", None)
+    current.timings = None
+
+    return timings
+
+
+def format_labels(key, extra=()):
+    """
+    formats labels as {name="value",...}
+    """
+
+    labels = [f'{name}="{value}"' for name, value in tuple(key) + extra]
+
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def render(gauges=None):
+    """
+    gives all metrics in the prometheus text format
+
+    parameters:
+        gauges - is a dictionary with name -> value of extra gauges (e.g. the
+                 state of the connection pool)
+
+    returns the text
+    """
+
+    lines = []
+
+    for name, value in sorted((gauges or dict()).items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+
+    with lock:
+        for name, series in sorted(histograms.items()):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+
+            for key, histogram in sorted(series.items()):
+
+                # the buckets are cumulative
+                total = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",),
+                                        histogram.counts):
+                    total += count
+                    labels = format_labels(key, (("le", bound),))
+                    lines.append(f"{name}_bucket{labels} {total}")
+
+                labels = format_labels(key)
+                lines.append(f"{name}_sum{labels} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{labels} {histogram.count}")
+
+        for name, series in sorted(counters.items()):
+            lines.append(f"# HELP {name} {HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{format_labels(key)} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+ratelimit.py defines a token bucket rate limiter, every key (like an ip
+    address or username) has a bucket which is filled at a fixed rate and
+    every request takes a token out of it
+
+the buckets are kept in a store with get/set/delete (see cache.py), a
+    TTLCache for one process or a RedisStore to share them between workers
+    (the read and write of a bucket aren't atomic in redis, so a few extra
+    requests can get through when many arrive at the same time)
+
+references:
+    https://en.wikipedia.org/wiki/Token_bucket
+"""
+
+# used imports
+import math
+import threading
+import time
+
+
+def parse_rate(rate):
+    """
+    converts a rate string "requests/seconds" (e.g. "10/60") to the size of
+        the bucket and the tokens added per second
+
+    parameters:
+        rate - is the rate string
+
+    returns a tuple with the burst (bucket size) and the rate per second
+    """
+
+    requests, seconds = str(rate).split("/")
+
+    return int(requests), int(requests) / float(seconds)
+
+
+class RateLimiter:
+    """
+    token buckets with the same size and rate for many keys
+    """
+
+    def __init__(self, store, rate, prefix="rate:"):
+        """
+        parameters:
+            store  - is the store of the buckets (TTLCache or RedisStore)
+            rate   - is the rate string "requests/seconds" (see parse_rate)
+            prefix - is put before the keys in the store
+        """
+
+        self.store = store
+        self.prefix = prefix
+        self.burst, self.rate = parse_rate(rate)
+
+        # a full bucket is the same as no bucket, so it can be removed
+        self.ttl = math.ceil(self.burst / self.rate) + 1
+
+        # one request at a time changes the buckets of this process
+        self._lock = threading.Lock()
+
+    def hit(self, key, cost=1):
+        """
+        takes tokens out of the bucket of a key if there are enough
+
+        parameters:
+            key  - is the key of the bucket (e.g. the ip address)
+            cost - is the number of tokens the request takes
+
+        returns 0 if the request is allowed, else the number of seconds
+            after which it would be allowed
+        """
+
+        key = self.prefix + str(key)
+        now = time.time()
+
+        with self._lock:
+
+            # a new bucket is full
+            tokens, updated = self.store.get(key, None) or (self.burst, now)
+
+            # add the tokens of the time since the last request
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+
+            if tokens < cost:
+                return (cost - tokens) / self.rate
+
+            self.store.set(key, [tokens - cost, now], self.ttl)
+
+        return 0
@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+ratings.py gets the goodreads ratings of all books and stores them in the
+    ratings table, so the book page doesn't have to ask goodreads
+
+usage (from the directory of application.py):
+    python -m functions.ratings [--chunk-size N] [--concurrency N]
+                                [--max-age SECONDS]
+
+    GOODREADS_URL can point to a local stub server for testing
+
+references:
+    https://docs.python.org/3/library/concurrent.futures.html
+"""
+
+# used imports
+from sqlalchemy import create_engine
+from sqlalchemy.orm import scoped_session, sessionmaker
+from concurrent.futures import ThreadPoolExecutor
+from functions.goodreads import RatingsProvider
+import argparse
+import os
+import requests
+import time
+
+
+def stale_books(db, max_age, chunk_size):
+    """
+    walks the books of which the rating is missing or older than max_age
+
+    parameters:
+        db         - is the database session
+        max_age    - is the age in seconds after which a rating is stale
+        chunk_size - is the number of books in a chunk
+
+    yields lists of isbns
+    """
+
+    last_id = 0
+    oldest = time.time() - max_age
+
+    # get the books chunk by chunk (the id of the last book is the start of
+    #   the next chunk)
+    while True:
+        rows = db.execute("SELECT books.id, books.isbn FROM books "
+                          "LEFT JOIN ratings ON ratings.isbn=books.isbn "
+                          "WHERE books.id > :last_id AND "
+                          "(ratings.fetched_at IS NULL OR "
+                          "ratings.fetched_at < :oldest) "
+                          "ORDER BY books.id LIMIT :limit",
+                          {"last_id": last_id, "oldest": oldest,
+                           "limit": chunk_size}).fetchall()
+
+        if not rows:
+            return
+
+        last_id = rows[-1].id
+        yield [row.isbn for row in rows]
+
+
+def store_ratings(db, ratings):
+    """
+    saves fetched ratings in the ratings table
+
+    parameters:
+        db      - is the database session
+        ratings - is a dictionary with isbn -> [avg rating, rating count] or
+                  None if the book has no rating
+    """
+
+    now = time.time()
+
+    db.execute("INSERT INTO ratings (isbn, average_rating, ratings_count, "
+               "fetched_at) VALUES (:isbn, :average, :count, :fetched_at) "
+               "ON CONFLICT (isbn) DO UPDATE SET "
+               "average_rating=excluded.average_rating, "
+               "ratings_count=excluded.ratings_count, "
+               "fetched_at=excluded.fetched_at",
+               [{"isbn": isbn,
+                 "average": rating[0] if rating else None,
+                 "count": rating[1] if rating else None,
+                 "fetched_at": now} for isbn, rating in ratings.items()])
+    db.commit()
+
+
+def refresh(db, provider, chunk_size=100, concurrency=4, max_age=24 * 3600):
+    """
+    fetches the ratings of all stale books, one request per chunk of books
+        with at most concurrency requests at the same time
+
+    parameters:
+        db          - is the database session
+        provider    - is the goodreads RatingsProvider
+        chunk_size  - is the number of isbns per request
+        concurrency - is the maximum number of requests at the same time
+        max_age     - is the age in seconds after which a rating is stale
+
+    returns the number of fetched books
+    """
+
+    count = 0
+
+    def store(futures):
+        """
+        waits for the requests and stores their ratings, failed requests are
+            skipped so they are fetched again the next time
+
+        returns the number of stored ratings
+        """
+
+        stored = 0
+        for future in futures:
+            try:
+                ratings = future.result()
+            except requests.RequestException as error:
+                print(f"request failed: {type(error).__name__}")
+                continue
+
+            store_ratings(db, ratings)
+            stored += len(ratings)
+
+        return stored
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        pending = []
+
+        for isbns in stale_books(db, max_age, chunk_size):
+            pending.append(pool.submit(provider.fetch, isbns, True))
+
+            # wait for the requests and store them when the pool is full,
+            #   so not all chunks are queued at once
+            if len(pending) >= concurrency:
+                count += store(pending)
+                pending = []
+
+        # store the last requests
+        count += store(pending)
+
+    return count
+
+
+def main():
+    """
+    refreshes the ratings of all books
+    """
+
+    # read the command line arguments
+    parser = argparse.ArgumentParser(description="get the goodreads ratings "
+                                     "of all books")
+    parser.add_argument("--chunk-size", type=int, default=100,
+                        help="isbns per request (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="requests at the same time (default: "
+                        "%(default)s)")
+    parser.add_argument("--max-age", type=float, default=24 * 3600,
+                        help="seconds after which a rating is fetched again "
+                        "(default: %(default)s)")
+    args = parser.parse_args()
+
+    # set up database
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    db = scoped_session(sessionmaker(bind=engine))
+
+    start = time.perf_counter()
+    count = refresh(db, RatingsProvider(timeout=(2, 10)), args.chunk_size,
+                    args.concurrency, args.max_age)
+
+    print(f"fetched the ratings of {count} books in "
+          f"{time.perf_counter() - start:.2f} s")
+
+
+# execute the main function if the program is run
+if __name__ == "__main__":
+    main()
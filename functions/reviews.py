@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+reviews.py writes the reviews and the review count/sum/average of the books,
+    one at a time or in batches by a background writer
+
+a second review of a user for the same book is skipped by the unique index
+    on reviews (user_id, book_id) (migration 5 of import.py)
+
+references:
+    https://docs.python.org/3/library/queue.html
+    https://www.postgresql.org/docs/current/sql-insert.html#SQL-ON-CONFLICT
+"""
+
+# used imports
+import logging
+import queue
+import threading
+import time
+
+from collections import namedtuple
+from functions import metrics
+
+log = logging.getLogger(__name__)
+
+# a review to write, the isbn is only used to tell which books changed
+Review = namedtuple("Review", ["user_id", "book_id", "isbn", "rating",
+                               "text"])
+
+
+def insert_review(db, review):
+    """
+    adds a review unless the user already reviewed the book (not committed)
+
+    parameters:
+        db     - is the database session
+        review - is the Review to add
+
+    returns True if the review was added
+    """
+
+    row = db.execute("INSERT INTO reviews (user_id, rating, text, book_id) "
+                     "VALUES (:user_id, :rating, :text, :book_id) "
+                     "ON CONFLICT (user_id, book_id) DO NOTHING RETURNING id",
+                     review._asdict()).fetchone()
+
+    return row is not None
+
+
+def update_aggregates(db, book_id, count, total):
+    """
+    adds reviews to the running count/sum/average of a book (the old values
+        are used on the right hand side, not committed)
+
+    parameters:
+        db      - is the database session
+        book_id - is the id of the book
+        count   - is the number of new reviews
+        total   - is the sum of the ratings of the new reviews
+    """
+
+    db.execute("UPDATE books SET "
+               "review_count=COALESCE(review_count, 0) + :count, "
+               "rating_sum=COALESCE(rating_sum, 0) + :total, "
+               "average_score=(COALESCE(rating_sum, 0) + :total) * 1.0 "
+               "/ (COALESCE(review_count, 0) + :count) WHERE id=:book_id",
+               {"book_id": book_id, "count": count, "total": total})
+
+
+def write_reviews(db, reviews):
+    """
+    adds reviews and updates the aggregates of their books with one update
+        per book, in one transaction
+
+    parameters:
+        db      - is the database session
+        reviews - is a list of Reviews
+
+    returns a list of the added Reviews
+    """
+
+    added = [review for review in reviews if insert_review(db, review)]
+
+    # the count and sum of the new ratings per book
+    books = dict()
+    for review in added:
+        count, total = books.get(review.book_id, (0, 0))
+        books[review.book_id] = (count + 1, total + review.rating)
+
+    for book_id, (count, total) in books.items():
+        update_aggregates(db, book_id, count, total)
+
+    db.commit()
+
+    return added
+
+
+class ReviewWriter:
+    """
+    background thread which writes the queued reviews in batches, so a
+        popular book gets one update per batch instead of one per review
+    """
+
+    def __init__(self, db, batch_size=100, interval=0.5, maxsize=10000,
+                 on_commit=None):
+        """
+        parameters:
+            db         - is the (scoped) database session
+            batch_size - is the maximum number of reviews in a batch
+            interval   - is the maximum time in seconds a review waits for
+                         more reviews of its batch
+            maxsize    - is the maximum number of queued reviews
+            on_commit  - is called with the list of added Reviews after
+                         every batch (e.g. to clear caches)
+        """
+
+        self.db = db
+        self.batch_size = batch_size
+        self.interval = interval
+        self.on_commit = on_commit
+
+        self._queue = queue.Queue(maxsize)
+        self._thread = None
+
+    def start(self):
+        """
+        starts the writer thread
+        """
+
+        self._thread = threading.Thread(target=self._run, name="reviews",
+                                        daemon=True)
+        self._thread.start()
+
+    def submit(self, review):
+        """
+        queues a review
+
+        parameters:
+            review - is the Review to write
+
+        returns False if the queue is full
+        """
+
+        try:
+            self._queue.put_nowait(review)
+        except queue.Full:
+            return False
+
+        return True
+
+    def stop(self):
+        """
+        writes the queued reviews and stops the writer thread
+        """
+
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        running = True
+
+        while running:
+
+            # wait for the first review of a batch
+            review = self._queue.get()
+            if review is None:
+                break
+
+            # add the reviews which arrive within the interval
+            batch = [review]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                try:
+                    review = self._queue.get(
+                        timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if review is None:
+                    running = False
+                    break
+                batch.append(review)
+
+            self._write(batch)
+
+    def _write(self, batch):
+        start = time.perf_counter()
+
+        try:
+            added = write_reviews(self.db, batch)
+        except Exception:
+            self.db.rollback()
+
+            # write the reviews one at a time, so only the bad ones are lost
+            added = []
+            for review in batch:
+                try:
+                    added.extend(write_reviews(self.db, [review]))
+                except Exception:
+                    self.db.rollback()
+                    metrics.inc("review_write_errors_total")
+                    log.exception("could not write the review of user %s "
+                                  "for book %s: %r", review.user_id,
+                                  review.book_id, review)
+        finally:
+            self.db.remove()
+
+        metrics.observe("review_batch_seconds", time.perf_counter() - start)
+        metrics.observe("review_batch_size", len(batch),
+                        metrics.COUNT_BUCKETS)
+
+        if self.on_commit is not None:
+            self.on_commit(added)
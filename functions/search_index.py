@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+search_index.py defines an in-memory trigram index over the books table
+
+references:
+    https://en.wikipedia.org/wiki/Inverted_index
+    https://www.postgresql.org/docs/current/pgtrgm.html
+"""
+
+# used imports
+import heapq
+import re
+import threading
+import time
+
+from collections import defaultdict
+
+# the book columns which are searchable
+FIELDS = ("title", "author", "isbn")
+
+# the weight of a match in each column for the ranking of the results
+WEIGHTS = (3, 2, 1)
+
+
+def normalize(text):
+    """
+    normalizes a text for the index (lowercase, no surrounding whitespace)
+
+    parameters:
+        text - is the text to be normalized
+
+    returns the normalized text
+    """
+
+    return str(text).strip().lower()
+
+
+def split_query(query):
+    """
+    splits a search query into single normalized words
+
+    parameters:
+        query - is the search query given by the user
+
+    returns a list of the (non-empty) words in the query
+    """
+
+    return [normalize(word) for word in re.split(r'\W+', str(query)) if word]
+
+
+def score(fields, words):
+    """
+    gives the relevance of a book for the search words, each word adds the
+        weights (see WEIGHTS) of the fields it is found in
+
+    parameters:
+        fields - are the normalized title, author and isbn of the book
+        words  - is a list of normalized words
+
+    returns the relevance score of the book
+    """
+
+    return sum(weight for word in words
+               for field, weight in zip(fields, WEIGHTS) if word in field)
+
+
+def parse_cursor(cursor):
+    """
+    converts a cursor string ("score:id") back to the key of the last result
+
+    parameters:
+        cursor - is the cursor string from the url
+
+    returns a (negative score, id) tuple or None if the cursor is invalid
+    """
+
+    try:
+        rank, book_id = str(cursor).split(":")
+        return (-int(rank), int(book_id))
+    except ValueError:
+        return None
+
+
+def paginate(ranked, page=1, per_page=30, after=None):
+    """
+    gives one page of the ranked results, the page starts after the cursor
+        (keyset pagination) if given, else at the page number
+
+    parameters:
+        ranked   - is a dictionary with book id -> score
+        page     - is the page number (starts at 1)
+        per_page - is the number of results on a page
+        after    - is the cursor string of the last result of the last page
+
+    returns a tuple with a list of the book ids on the page (best first) and
+        the cursor of the next page (None if this is the last page)
+    """
+
+    # order by best score first and use the id for equal scores
+    keys = ((-rank, book_id) for book_id, rank in ranked.items())
+
+    # find where the page begins
+    last = parse_cursor(after) if after else None
+    if last is not None:
+        keys = (key for key in keys if key > last)
+        start = 0
+    else:
+        start = (max(page, 1) - 1) * per_page
+
+    # only the keys up to the end of the page are sorted, with one more to
+    #   know if there is a next page
+    page_keys = heapq.nsmallest(start + per_page + 1, keys)[start:]
+
+    # the cursor of the next page is the key of the last result on this page
+    if len(page_keys) > per_page:
+        page_keys = page_keys[:per_page]
+        rank, book_id = page_keys[-1]
+        cursor = f"{-rank}:{book_id}"
+    else:
+        cursor = None
+
+    return [book_id for rank, book_id in page_keys], cursor
+
+
+def trigrams(text):
+    """
+    gives all trigrams (3 character substrings) of a text
+
+    parameters:
+        text - is the (normalized) text to split in trigrams
+
+    returns a set with the trigrams of the text
+    """
+
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """
+    inverted trigram index over the title, author and isbn of the books
+
+    a word is found in a book if it is a substring of one of the fields,
+        which is the same as the "ILIKE '%word%'" query it replaces
+    """
+
+    def __init__(self):
+
+        # lock for changing or reading the index from multiple threads
+        self._lock = threading.RLock()
+
+        # book id -> normalized fields and trigram -> set of book ids
+        self._docs = dict()
+        self._postings = defaultdict(set)
+
+        # ids of the books with a field shorter than a trigram
+        self._short = set()
+
+        # the time of the last build/refresh
+        self.refreshed = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, book_id, title, author, isbn):
+        """
+        adds (or replaces) a book in the index
+
+        parameters:
+            book_id - is the id of the book in the database
+            title   - is the title of the book
+            author  - is the author of the book
+            isbn    - is the isbn of the book
+        """
+
+        # normalize the searchable fields
+        fields = tuple(normalize(field) for field in (title, author, isbn))
+
+        with self._lock:
+
+            # remove the old version of the book if it was indexed already
+            if book_id in self._docs:
+                self.remove(book_id)
+
+            # add the book and its trigrams to the index
+            self._docs[book_id] = fields
+            for field in fields:
+                for gram in trigrams(field):
+                    self._postings[gram].add(book_id)
+
+            if any(len(field) < 3 for field in fields):
+                self._short.add(book_id)
+
+    def remove(self, book_id):
+        """
+        removes a book from the index
+
+        parameters:
+            book_id - is the id of the book in the database
+        """
+
+        with self._lock:
+            fields = self._docs.pop(book_id, None)
+
+            # nothing to do if the book wasn't indexed
+            if fields is None:
+                return
+
+            self._short.discard(book_id)
+
+            # remove the book from the postings (and drop empty postings)
+            for field in fields:
+                for gram in trigrams(field):
+                    posting = self._postings.get(gram)
+                    if posting is not None:
+                        posting.discard(book_id)
+                        if not posting:
+                            del self._postings[gram]
+
+    def load(self, rows):
+        """
+        adds database rows to the index
+
+        parameters:
+            rows - are rows with an id, title, author and isbn attribute
+        """
+
+        with self._lock:
+            for row in rows:
+                self.add(row.id, row.title, row.author, row.isbn)
+
+    def build(self, db):
+        """
+        (re)builds the whole index from the books table, the new index is
+            made next to the old one so searches go on while it is built
+
+        parameters:
+            db - is the database session
+        """
+
+        rows = db.execute("SELECT id, title, author, isbn FROM books "
+                          "ORDER BY id").fetchall()
+
+        index = SearchIndex()
+        index.load(rows)
+
+        # replace the index at once
+        with self._lock:
+            self._docs = index._docs
+            self._postings = index._postings
+            self._short = index._short
+            self.refreshed = time.monotonic()
+
+    def refresh(self, db):
+        """
+        brings the index up to date with the books table, the new and
+            changed books (e.g. by "import.py load --upsert") are added again
+            and the deleted books are removed
+
+        parameters:
+            db - is the database session
+
+        returns the number of added/changed and of removed books
+        """
+
+        rows = db.execute("SELECT id, title, author, isbn FROM books "
+                          "ORDER BY id").fetchall()
+
+        # compare with a copy, so the index isn't locked while comparing
+        with self._lock:
+            docs = dict(self._docs)
+
+        changed = [row for row in rows if docs.pop(row.id, None) !=
+                   tuple(normalize(field)
+                         for field in (row.title, row.author, row.isbn))]
+
+        # the books which are left in the copy aren't in the table anymore
+        with self._lock:
+            self.load(changed)
+            for book_id in docs:
+                self.remove(book_id)
+            self.refreshed = time.monotonic()
+
+        return len(changed), len(docs)
+
+    def lookup(self, word):
+        """
+        finds all books where the word is part of the title/author/isbn
+
+        parameters:
+            word - is the normalized word to look for
+
+        returns a set of book ids
+        """
+
+        with self._lock:
+
+            # a word shorter than a trigram is in a field (of 3 or more
+            #   characters) if it is in one of its trigrams, so the books are
+            #   the postings of those trigrams (without scanning all books)
+            if len(word) < 3:
+                found = set().union(*(posting for gram, posting
+                                      in self._postings.items()
+                                      if word in gram))
+                found.update(book_id for book_id in self._short
+                             if any(word in field
+                                    for field in self._docs[book_id]))
+                return found
+
+            # otherwise intersect the postings of the trigrams of the word,
+            #   starting with the smallest one
+            else:
+                postings = sorted((self._postings.get(gram, set())
+                                   for gram in trigrams(word)), key=len)
+                candidates = set(postings[0])
+                for posting in postings[1:]:
+                    candidates &= posting
+                    if not candidates:
+                        break
+
+            # the trigrams may be in a different order so verify the match
+            return {book_id for book_id in candidates
+                    if any(word in field for field in self._docs[book_id])}
+
+    def search(self, words, match_all=False):
+        """
+        finds all books where any (or all) of the words are found
+
+        parameters:
+            words     - is a list of normalized words (see split_query)
+            match_all - only give the books where all words are found
+
+        returns a set of book ids
+        """
+
+        results = None
+        for word in words:
+            found = self.lookup(word)
+            if results is None:
+                results = found
+            elif match_all:
+                results &= found
+            else:
+                results |= found
+
+        return results or set()
+
+    def rank(self, words, match_all=False):
+        """
+        finds all books where any (or all) of the words are found and scores
+            them
+
+        parameters:
+            words     - is a list of normalized words (see split_query)
+            match_all - only give the books where all words are found
+
+        returns a dictionary with book id -> score (see score)
+        """
+
+        with self._lock:
+            return {book_id: score(self._docs[book_id], words)
+                    for book_id in self.search(words, match_all)}
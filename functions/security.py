@@ -4,42 +4,103 @@
 version: python 3+
 securiy.py defines the hash function and compare function
 Dani van Enk, 11823526
+
+hashes are stored as "pbkdf2_sha512$iterations$salt$hash" (salt and hash in
+    hex) so the number of iterations can be changed, the old format (salt
+    and hash interleaved character by character) can still be compared
+
+the hashing can run in a process pool (hash_async/compare_async) so it
+    doesn't block the web workers, PBKDF2_ITERATIONS sets the number of
+    iterations, HASH_WORKERS the size of the pool and HASH_QUEUE the number
+    of hashes which may wait for the pool
 """
 
 # used libraries
 import os
 import hashlib
-import binascii
+import hmac
+import multiprocessing
+import threading
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functions import metrics
+
+# the algorithm and number of iterations of new hashes
+ALGORITHM = "pbkdf2_sha512"
+ITERATIONS = int(os.getenv("PBKDF2_ITERATIONS", 500000))
+
+# the number of processes in the pool and the number of waiting hashes
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", os.cpu_count() or 1))
+HASH_QUEUE = int(os.getenv("HASH_QUEUE", 4 * HASH_WORKERS))
+
+# the iterations of the old interleaved format
+LEGACY_ITERATIONS = 500000
 
 
-def hash_psswd(password):
+class HashingBusy(RuntimeError):
+    """
+    raised when too many hashes are waiting for the process pool
+    """
+
+
+def pbkdf2(password, salt, iterations):
+    """
+    hashes a password using pbkdf2 with the sha512 algorithm
+
+    parameters:
+        password   - is the password to be hashed
+        salt       - is the salt (bytes)
+        iterations - is the number of iterations
+
+    returns the hash (bytes)
+    """
+
+    return hashlib.pbkdf2_hmac('sha512', str(password).encode('utf-8'), salt,
+                               iterations)
+
+
+def hash_psswd(password, iterations=None):
     """
     hashes the given password using the sha512 algorithm
 
     parameters:
-        password - is the password to be hashed
+        password   - is the password to be hashed
+        iterations - is the number of iterations (None for ITERATIONS)
 
     returns the hash string
     """
 
+    iterations = iterations or ITERATIONS
+
     # generate a random salt and use that to hash the password
-    psswd_salt = hashlib.sha512(os.urandom(64)).hexdigest().encode("utf-8")
-    psswd_hash = hashlib.pbkdf2_hmac('sha512', bytearray(password, 'utf-8'),
-                                     bytearray(psswd_salt), 500000)
+    psswd_salt = os.urandom(16)
+    psswd_hash = pbkdf2(password, psswd_salt, iterations)
+
+    return f"{ALGORITHM}${iterations}${psswd_salt.hex()}${psswd_hash.hex()}"
+
 
-    # convert the salt and hash to hex
-    psswd_salt_hex = psswd_salt.decode("utf-8")
-    psswd_hash_hex = binascii.hexlify(psswd_hash).decode("utf-8")
+def split_hash(stored):
+    """
+    splits a stored hash in its parts
+
+    parameters:
+        stored - is the stored hash string (new or old format)
 
-    # begin with an empty hash string
-    hash_string = ""
+    returns a tuple with the algorithm, iterations, salt (bytes) and
+        hash (hex)
+    """
 
-    # combine the salt and the hash into 1 string
-    for i in range(len(psswd_salt_hex)):
-        hash_string += psswd_salt_hex[i]
-        hash_string += psswd_hash_hex[i]
+    # new format: algorithm$iterations$salt$hash
+    if stored.startswith(ALGORITHM + "$"):
+        algorithm, iterations, salt, psswd_hash = stored.split("$")
+        return algorithm, int(iterations), bytes.fromhex(salt), psswd_hash
 
-    return hash_string
+    # old format: the characters of the salt and hash are interleaved and
+    #   the hex string of the salt itself was used as the salt
+    return "legacy", LEGACY_ITERATIONS, stored[0::2].encode("utf-8"), \
+        stored[1::2]
 
 
 def compare_hash(stored, psswd):
@@ -53,26 +114,170 @@ def compare_hash(stored, psswd):
     returns the comparison between stored and the hash resulting from psswd
     """
 
-    # begin with an empty string for the salt
-    hash_salt = ""
-
-    # extract the salt from the stored hash string
-    for i in range(len(stored)):
-        if i % 2 == 0:
-            hash_salt += stored[i]
+    # get the salt and hash from the stored hash string
+    algorithm, iterations, salt, psswd_hash = split_hash(stored)
 
     # hash the given password with the extracted salt and convert it to hex
-    hash_passwd = hashlib.pbkdf2_hmac('sha512', bytearray(psswd, 'utf-8'),
-                                      bytearray(hash_salt.encode('utf-8')),
-                                      500000)
-    hash_passwd_hex = binascii.hexlify(hash_passwd).decode("utf-8")
+    hash_passwd_hex = pbkdf2(psswd, salt, iterations).hex()
+
+    # compare in constant time
+    return hmac.compare_digest(hash_passwd_hex, psswd_hash)
+
+
+def needs_rehash(stored):
+    """
+    checks if a stored hash should be made again (old format or other
+        number of iterations)
+
+    parameters:
+        stored - is the stored hash string
+
+    returns True if the password should be hashed again
+    """
+
+    algorithm, iterations, salt, psswd_hash = split_hash(stored)
+
+    return algorithm != ALGORITHM or iterations != ITERATIONS
+
+
+# the process pool (made when first used) and the places left in the queue
+pool = None
+pool_lock = threading.Lock()
+queue = threading.BoundedSemaphore(HASH_QUEUE)
+
+# the average time of a compare (with the waiting for the pool), None until
+#   the first compare
+compare_seconds = None
+
+
+def take_place(wait):
+    """
+    waits for a place in the queue of the process pool (release it with
+        queue.release())
+
+    parameters:
+        wait - is the time in seconds to wait for a place in the queue
+
+    raises HashingBusy if the queue stays full
+    """
+
+    if not queue.acquire(timeout=wait):
+        metrics.inc("hashing_busy_total")
+        raise HashingBusy("Too many logins at the same time, try again")
+
+
+def run_hashing(function, *args, wait=1):
+    """
+    runs a hash function in the process pool, or in this thread if
+        HASH_WORKERS is 0
+
+    parameters:
+        function - is the function to run (hash_psswd or compare_hash)
+        args     - are the arguments of the function
+        wait     - is the time in seconds to wait for a place in the queue
+
+    returns the result of the function
+    raises HashingBusy if the queue stays full or a process of the pool died
+    """
+
+    global pool, compare_seconds
+
+    start = time.perf_counter()
+
+    try:
+        if HASH_WORKERS < 1:
+            return function(*args)
+
+        # wait for a place in the queue
+        take_place(wait)
+
+        try:
+
+            # start the pool when it is first used, the processes are
+            #   spawned because forking a process with threads isn't safe
+            with pool_lock:
+                if pool is None:
+                    pool = ProcessPoolExecutor(
+                        max_workers=HASH_WORKERS,
+                        mp_context=multiprocessing.get_context("spawn"))
+                current = pool
+
+            return current.submit(function,
+                                  *[str(arg) for arg in args]).result()
+
+        # a process of the pool died, start a new pool at the next hash
+        except BrokenProcessPool:
+            with pool_lock:
+                if pool is current:
+                    pool = None
+            current.shutdown(wait=False)
+            metrics.inc("hashing_busy_total")
+            raise HashingBusy("The password could not be checked, try again")
+        finally:
+            queue.release()
+
+    # measure the time of the hashing (with the waiting for the pool)
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.observe("pbkdf2_seconds", seconds, function=function.__name__)
+        metrics.add_timing("kdf", seconds)
+
+        # keep a moving average of the compare time (see compare_unknown)
+        if function is compare_hash:
+            compare_seconds = seconds if compare_seconds is None else \
+                0.9 * compare_seconds + 0.1 * seconds
+
+
+def hash_async(password, wait=1):
+    """
+    hashes a password in the process pool (see hash_psswd and run_hashing)
+    """
+
+    return run_hashing(hash_psswd, password, wait=wait)
+
+
+def compare_async(stored, psswd, wait=1):
+    """
+    compares a password in the process pool (see compare_hash and
+        run_hashing)
+    """
+
+    return run_hashing(compare_hash, stored, psswd, wait=wait)
+
+
+def compare_unknown(wait=1):
+    """
+    takes about as long as compare_async for a username which doesn't exist,
+        so the response time doesn't tell if a username exists, it sleeps
+        the average compare time instead of hashing (only the first time it
+        compares with a dummy hash to measure it)
+
+    the sleep takes a place in the queue like a compare, so a full queue
+        gives HashingBusy for unknown usernames too
+
+    parameters:
+        wait - is the time in seconds to wait for a place in the queue
+
+    returns False
+    raises HashingBusy if the queue stays full
+    """
+
+    if compare_seconds is None:
+        dummy = f"{ALGORITHM}${ITERATIONS}${'00' * 16}${'00' * 64}"
+        compare_async(dummy, "", wait=wait)
+        return False
+
+    if HASH_WORKERS < 1:
+        time.sleep(compare_seconds)
+        return False
 
-    # begin with an empty hash string
-    hash_string = ""
+    # the average compare time includes the waiting for the queue
+    start = time.perf_counter()
+    take_place(wait)
 
-    # combine the hash and salt
-    for i in range(len(hash_passwd_hex)):
-        hash_string += hash_salt[i]
-        hash_string += hash_passwd_hex[i]
+    try:
+        time.sleep(max(compare_seconds - (time.perf_counter() - start), 0))
+    finally:
+        queue.release()
 
-    return hash_string == stored
+    return False
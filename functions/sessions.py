@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+sessions.py sets up the session backend of the flask app
+
+backends (SESSION_BACKEND):
+    cookie      - signed cookie (flask default), needs a fixed SECRET_KEY if
+                  there are multiple workers
+    memory      - least recently used store in the process (one process only)
+    redis       - redis store (REDIS_URL), shared between workers
+    filesystem  - flask-session file store, old files are removed
+
+references:
+    https://flask.palletsprojects.com/en/1.1.x/api/#session-interface
+    https://github.com/fengsp/flask-session
+"""
+
+# used imports
+import os
+import secrets
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+from functions.cache import TTLCache, RedisStore, redis_client
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    """
+    session of which only the id is kept in the cookie
+    """
+
+    def __init__(self, initial=None, sid=None, new=False):
+
+        # mark the session as modified when it is changed
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class StoreSessionInterface(SessionInterface):
+    """
+    keeps the session data in a store (with get/set/delete) and the random
+        session id in the cookie, the store is only written when the session
+        was changed
+    """
+
+    def __init__(self, store, prefix="session:"):
+        """
+        parameters:
+            store  - is the store for the sessions (TTLCache or RedisStore)
+            prefix - is put in front of the session id to make the key
+        """
+
+        self.store = store
+        self.prefix = prefix
+
+    def open_session(self, app, request):
+        """
+        gets the session of the session id in the cookie (or a new one)
+        """
+
+        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+
+        # get the data of the session if it exists
+        if sid:
+            data = self.store.get(self.prefix + sid, None)
+            if data is not None:
+                return ServerSession(data, sid=sid)
+
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        """
+        saves the session in the store and sets the cookie if it changed
+        """
+
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        name = app.config["SESSION_COOKIE_NAME"]
+
+        # remove an emptied session
+        if not session:
+            if session.modified:
+                self.store.delete(self.prefix + session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # nothing to save if the session didn't change
+        if not session.modified:
+            return
+
+        # save the session for as long as it may live
+        ttl = app.permanent_session_lifetime.total_seconds()
+        self.store.set(self.prefix + session.sid, dict(session), ttl)
+
+        response.set_cookie(name, session.sid,
+                            expires=self.get_expiration_time(app, session),
+                            httponly=self.get_cookie_httponly(app),
+                            domain=domain, path=path,
+                            secure=self.get_cookie_secure(app),
+                            samesite=self.get_cookie_samesite(app))
+
+
+def collect_garbage(directory, max_age):
+    """
+    removes the session files which weren't changed for a while
+
+    parameters:
+        directory - is the directory with the session files
+        max_age   - is the age in seconds after which a file is removed
+
+    returns the number of removed files
+    """
+
+    removed = 0
+    oldest = time.time() - max_age
+
+    # check the age of every file in the directory
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return removed
+
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < oldest:
+                os.remove(entry.path)
+                removed += 1
+
+        # the file may have been removed by an other worker
+        except OSError:
+            pass
+
+    return removed
+
+
+def init_app(app, backend):
+    """
+    sets up the session backend of the app
+
+    parameters:
+        app     - is the flask app
+        backend - is the name of the backend (cookie/memory/redis/filesystem)
+    """
+
+    # the time a session is kept in a store
+    lifetime = app.permanent_session_lifetime.total_seconds()
+
+    # the signed cookie sessions are the default of flask
+    if backend == "cookie":
+        return
+
+    elif backend == "memory":
+        store = TTLCache(int(os.getenv("SESSION_MAX", 10000)), lifetime)
+        app.session_interface = StoreSessionInterface(store)
+
+    elif backend == "redis":
+        store = RedisStore(redis_client(), lifetime)
+        app.session_interface = StoreSessionInterface(store)
+
+    elif backend == "filesystem":
+        from flask_session import Session
+
+        app.config["SESSION_TYPE"] = "filesystem"
+        app.config.setdefault("SESSION_FILE_DIR",
+                              os.path.join(os.getcwd(), "flask_session"))
+        Session(app)
+
+        # remove the old sessions (at start and every hour)
+        directory = app.config["SESSION_FILE_DIR"]
+        collect_garbage(directory, lifetime)
+        last_collect = [time.monotonic()]
+
+        @app.teardown_request
+        def collect_sessions(error=None):
+            if time.monotonic() - last_collect[0] > 3600:
+                last_collect[0] = time.monotonic()
+                collect_garbage(directory, lifetime)
+
+    else:
+        raise RuntimeError(f"unknown SESSION_BACKEND {backend}")
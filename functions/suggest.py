@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+suggest.py defines an in-memory prefix index over the titles, authors and
+    isbns of the books for the search suggestions (typeahead), the matches
+    of a prefix are ranked by their number of reviews
+
+references:
+    https://docs.python.org/3/library/bisect.html
+"""
+
+# used imports
+import bisect
+import heapq
+import threading
+import time
+
+from functions.search_index import normalize
+
+# prefixes shorter than this are answered from a precomputed top list
+SHORT_PREFIX = 4
+
+# number of books kept per short prefix
+SHORT_TOP = 50
+
+
+class PrefixIndex:
+    """
+    sorted array of (key, isbn) tuples, a prefix is found with bisect
+
+    the keys are the normalized title, author and isbn and every part of the
+        title and author which starts at a word, so "potter" finds "Harry
+        Potter and the Chamber of Secrets"
+    """
+
+    def __init__(self, max_scan=2000):
+        """
+        parameters:
+            max_scan - is the maximum number of keys ranked for one prefix
+                       when it is asked, prefixes with more keys get a
+                       precomputed top list
+        """
+
+        # lock for replacing the index while it is read
+        self._lock = threading.Lock()
+
+        # the sorted keys, isbn -> (title, author) and isbn -> review count
+        self._keys = []
+        self._books = dict()
+        self._counts = dict()
+
+        # prefix (shorter than SHORT_PREFIX, or of more than max_scan keys)
+        #   -> isbns with the most reviews
+        self._short = dict()
+
+        self.max_scan = max_scan
+        self.refreshed = 0
+
+    def __len__(self):
+        return len(self._books)
+
+    @staticmethod
+    def keys(title, author, isbn):
+        """
+        gives the index keys of a book
+
+        parameters:
+            title  - is the title of the book
+            author - is the author of the book
+            isbn   - is the isbn of the book
+
+        returns a set with the normalized keys
+        """
+
+        keys = {normalize(isbn)}
+        for field in (title, author):
+            words = normalize(field).split()
+            keys.update(" ".join(words[i:]) for i in range(len(words)))
+
+        return keys
+
+    def build(self, db):
+        """
+        (re)builds the whole index from the books table
+
+        parameters:
+            db - is the database session
+        """
+
+        rows = db.execute("SELECT isbn, title, author, "
+                          "COALESCE(review_count, 0) AS review_count "
+                          "FROM books").fetchall()
+
+        keys = []
+        books = dict()
+        counts = dict()
+        for row in rows:
+            books[row.isbn] = (row.title, row.author)
+            counts[row.isbn] = row.review_count
+            keys.extend((key, row.isbn)
+                        for key in self.keys(row.title, row.author, row.isbn))
+        keys.sort()
+
+        # the isbns with the most reviews for every short prefix
+        short = dict()
+        for key, isbn in keys:
+            for length in range(1, SHORT_PREFIX):
+                if len(key) >= length:
+                    short.setdefault(key[:length], set()).add(isbn)
+        short = {prefix: heapq.nlargest(SHORT_TOP, isbns, key=counts.get)
+                 for prefix, isbns in short.items()}
+
+        # and for the longer prefixes with more than max_scan keys
+        short.update(self.long_tops(keys, counts))
+
+        # replace the index at once
+        with self._lock:
+            self._keys = keys
+            self._books = books
+            self._counts = counts
+            self._short = short
+            self.refreshed = time.monotonic()
+
+    def long_tops(self, keys, counts):
+        """
+        finds the prefixes (of SHORT_PREFIX or more characters) with more
+            than max_scan keys and their books with the most reviews, a
+            prefix one character longer can only have more than max_scan
+            keys if its prefix has, so only their ranges are searched
+
+        parameters:
+            keys   - is the sorted list of (key, isbn) tuples
+            counts - is a dictionary with isbn -> review count
+
+        returns a dictionary with prefix -> isbns with the most reviews
+        """
+
+        tops = dict()
+        ranges = [(0, len(keys))]
+        length = SHORT_PREFIX
+
+        while ranges:
+            longer = []
+            for start, stop in ranges:
+
+                # go through the ranges of the prefixes of this length
+                index = start
+                while index < stop:
+                    key = keys[index][0]
+                    if len(key) < length:
+                        index += 1
+                        continue
+
+                    prefix = key[:length]
+                    end = bisect.bisect_left(keys, (prefix + "\uffff",),
+                                             index, stop)
+                    if end - index > self.max_scan:
+                        tops[prefix] = heapq.nlargest(
+                            SHORT_TOP, {isbn for key, isbn in keys[index:end]},
+                            key=counts.get)
+                        longer.append((index, end))
+                    index = end
+
+            ranges = longer
+            length += 1
+
+        return tops
+
+    def add_review(self, isbn):
+        """
+        counts a new review of a book for the ranking
+
+        parameters:
+            isbn - is the isbn of the reviewed book
+        """
+
+        with self._lock:
+            if isbn in self._counts:
+                self._counts[isbn] += 1
+
+    def suggest(self, query, limit=10):
+        """
+        finds the books of which a key starts with the query
+
+        parameters:
+            query - is the (partial) text typed by the user
+            limit - is the maximum number of suggestions
+
+        returns a list of dictionaries with the isbn, title, author and
+            review count of the books (most reviews first)
+        """
+
+        prefix = " ".join(normalize(query).split())
+        if not prefix:
+            return []
+
+        with self._lock:
+            keys, books, counts = self._keys, self._books, self._counts
+
+            # short prefixes and prefixes of more than max_scan keys match
+            #   too many keys, use the precomputed list
+            if len(prefix) < SHORT_PREFIX or prefix in self._short:
+                isbns = self._short.get(prefix, [])
+
+            # otherwise all keys between the prefix and the prefix followed
+            #   by the highest character (at most max_scan)
+            else:
+                start = bisect.bisect_left(keys, (prefix,))
+                end = bisect.bisect_left(keys, (prefix + "\uffff",), start)
+                isbns = {isbn for key, isbn in keys[start:end]}
+
+            ranked = heapq.nlargest(limit, isbns,
+                                    key=lambda isbn: (counts[isbn], isbn))
+
+            return [{"isbn": isbn, "title": books[isbn][0],
+                     "author": books[isbn][1], "review_count": counts[isbn]}
+                    for isbn in ranked]
@@ -42,6 +42,56 @@ function init() {
             };
         }, false);
     });
+
+    // show suggestions while typing in the search bar
+    const search = document.querySelector("#search");
+    if (search && search.dataset.suggest) {
+        suggestions(search, document.querySelector("#suggestions"));
+    };
+}
+
+// suggestions() asks the suggestion api for the typed text (at most once per
+//  150 ms of typing) and shows the books as links below the search bar
+function suggestions(search, list) {
+    let timer = null;
+    let controller = null;
+
+    search.addEventListener("input", function() {
+        clearTimeout(timer);
+
+        timer = setTimeout(function() {
+            const query = search.value.trim();
+
+            // cancel the request of the text typed before
+            if (controller) {
+                controller.abort();
+            };
+
+            if (query === "") {
+                list.innerHTML = "";
+                return;
+            };
+
+            controller = new AbortController();
+            const url = search.dataset.suggest + "?q=" + encodeURIComponent(query);
+
+            fetch(url, {signal: controller.signal})
+                .then(response => response.json())
+                .then(function(books) {
+                    list.innerHTML = "";
+
+                    // add a link to the book page of each suggestion
+                    for (const book of books) {
+                        const link = document.createElement("a");
+                        link.className = "list-group-item list-group-item-action";
+                        link.href = book.url;
+                        link.textContent = book.title + " - " + book.author;
+                        list.appendChild(link);
+                    };
+                })
+                .catch(function() {});
+        }, 150);
+    }, false);
 }
 // make sure DOMContent is loaded before the code runs
 document.addEventListener("DOMContentLoaded", init, false);
\ No newline at end of file
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+version: python 3+
+test_security.py checks that the hashes of the old interleaved format still
+    verify and are made again, and that the new format verifies
+
+usage (from the directory of application.py):
+    python -m pytest tests
+"""
+
+# used imports
+import hashlib
+import unittest
+
+from functions import security
+
+
+def legacy_hash(password, salt):
+    """
+    hashes a password like the first version of security.py (the hex salt
+        itself is the salt and its characters are interleaved with the
+        characters of the hash)
+
+    parameters:
+        password - is the password to be hashed
+        salt     - is the salt as a hex string (128 characters)
+
+    returns the hash string
+    """
+
+    psswd_hash = hashlib.pbkdf2_hmac("sha512", password.encode("utf-8"),
+                                     salt.encode("utf-8"),
+                                     security.LEGACY_ITERATIONS).hex()
+
+    return "".join(salt[i] + psswd_hash[i] for i in range(len(salt)))
+
+
+class TestHashFormats(unittest.TestCase):
+
+    def test_legacy_hash_verifies(self):
+        stored = legacy_hash("secret", hashlib.sha512(b"salt").hexdigest())
+
+        self.assertTrue(security.compare_hash(stored, "secret"))
+        self.assertFalse(security.compare_hash(stored, "wrong"))
+        self.assertTrue(security.needs_rehash(stored))
+
+    def test_new_hash_round_trip(self):
+        stored = security.hash_psswd("secret", iterations=1000)
+
+        self.assertTrue(stored.startswith(security.ALGORITHM + "$1000$"))
+        self.assertTrue(security.compare_hash(stored, "secret"))
+        self.assertFalse(security.compare_hash(stored, "wrong"))
+
+    def test_needs_rehash_iterations(self):
+        current = f"{security.ALGORITHM}${security.ITERATIONS}$" \
+            f"{'00' * 16}${'00' * 64}"
+        other = f"{security.ALGORITHM}$1000${'00' * 16}${'00' * 64}"
+
+        self.assertFalse(security.needs_rehash(current))
+        self.assertTrue(security.needs_rehash(other))
+
+
+# run the tests if the program is run
+if __name__ == "__main__":
+    unittest.main()